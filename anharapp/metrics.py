@@ -0,0 +1,193 @@
+"""
+Request performance instrumentation.
+
+PerformanceMiddleware times every request and records, per URL name, the wall time, the number
+and duration of database queries, the time spent producing serializer data and the response size.
+The figures are sent back in a Server-Timing header and aggregated into in-process histograms
+that /metrics exposes in the Prometheus text format. Requests slower than
+PERFORMANCE_SLOW_REQUEST_MS log their slowest queries together with the code that ran them.
+"""
+import heapq
+import logging
+import sys
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger('anharapp.performance')
+
+_current = ContextVar('request_metrics', default=None)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}  # label -> [bucket counts..., sum, count]
+
+    def observe(self, label, value):
+        series = self.series.setdefault(label, [0] * len(self.buckets) + [0, 0])
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label, series in sorted(self.series.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{view="{label}",le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{view="{label}",le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{view="{label}"}} {series[-2]}')
+            lines.append(f'{self.name}_count{{view="{label}"}} {series[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {
+            'duration': Histogram('anharapp_request_duration_seconds', 'Wall time of the request.',
+                                  DURATION_BUCKETS),
+            'db_duration': Histogram('anharapp_db_duration_seconds', 'Time spent in database queries.',
+                                     DURATION_BUCKETS),
+            'db_queries': Histogram('anharapp_db_queries', 'Database queries per request.', QUERY_COUNT_BUCKETS),
+            'serializer_duration': Histogram('anharapp_serializer_duration_seconds',
+                                             'Time spent producing serializer data.', DURATION_BUCKETS),
+            'response_size': Histogram('anharapp_response_size_bytes', 'Size of the response body.', SIZE_BUCKETS),
+        }
+
+    def observe(self, label, **values):
+        with self.lock:
+            for name, value in values.items():
+                if value is not None:
+                    self.histograms[name].observe(label, value)
+
+    def render(self):
+        with self.lock:
+            lines = [line for histogram in self.histograms.values() for line in histogram.render()]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class RequestMetrics:
+    def __init__(self, slow_query_log_size):
+        self.query_count = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.slow_query_log_size = slow_query_log_size
+        self.slowest_queries = []  # Min-heap of (duration, sequence, sql, call site)
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.query_count += 1
+            self.db_time += duration
+            # Only the queries that make it into the slowest few pay for the stack walk
+            if len(self.slowest_queries) < self.slow_query_log_size:
+                heapq.heappush(self.slowest_queries, (duration, self.query_count, sql, _call_site()))
+            elif self.slowest_queries and duration > self.slowest_queries[0][0]:
+                heapq.heapreplace(self.slowest_queries, (duration, self.query_count, sql, _call_site()))
+
+
+_PROJECT_DIR = str(Path(settings.BASE_DIR))
+
+
+def _call_site():
+    # The innermost frame of our own code, e.g. the serializer method that triggered a lazy load
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_PROJECT_DIR) and 'site-packages' not in filename and filename != __file__:
+            return f'{filename[len(_PROJECT_DIR) + 1:]}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'unknown'
+
+
+def _instrument_serializers():
+    # Time the outermost serializer .data access; nested serializers run inside it
+    original = BaseSerializer.data
+    if getattr(original.fget, 'instrumented', False):
+        return
+
+    def data(self):
+        metrics = _current.get()
+        if metrics is None or metrics.serializer_depth:
+            return original.fget(self)
+        metrics.serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return original.fget(self)
+        finally:
+            metrics.serializer_time += time.perf_counter() - start
+            metrics.serializer_depth -= 1
+
+    data.instrumented = True
+    BaseSerializer.data = property(data)
+
+
+class PerformanceMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_request_time = getattr(settings, 'PERFORMANCE_SLOW_REQUEST_MS', 500) / 1000
+        self.slow_query_log_size = getattr(settings, 'PERFORMANCE_SLOW_QUERY_LOG_SIZE', 5)
+        _instrument_serializers()
+
+    def __call__(self, request):
+        metrics = RequestMetrics(self.slow_query_log_size)
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics.record_query))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        duration = time.perf_counter() - start
+
+        label = request.resolver_match.url_name if request.resolver_match else 'unmatched'
+        size = None if response.streaming else len(response.content)
+        registry.observe(label, duration=duration, db_duration=metrics.db_time, db_queries=metrics.query_count,
+                         serializer_duration=metrics.serializer_time, response_size=size)
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.query_count} queries"',
+            f'serializer;dur={metrics.serializer_time * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ])
+
+        if duration >= self.slow_request_time and metrics.slowest_queries:
+            queries = '\n'.join(
+                f'  {query_duration * 1000:.1f} ms at {call_site}: {sql}'
+                for query_duration, _, sql, call_site in sorted(metrics.slowest_queries, reverse=True)
+            )
+            logger.warning('Slow request %s %s (%s): %.0f ms, %d queries, slowest:\n%s', request.method,
+                           request.path, label, duration * 1000, metrics.query_count, queries)
+        return response
+
+
+def metrics_view(request):
+    allowed = getattr(settings, 'PERFORMANCE_METRICS_IPS', ['127.0.0.1'])
+    if request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4')
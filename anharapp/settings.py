@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'anharapp.metrics.PerformanceMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -62,6 +63,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Request instrumentation, see anharapp.metrics
+PERFORMANCE_SLOW_REQUEST_MS = 500  # Requests slower than this log their slowest queries
+PERFORMANCE_SLOW_QUERY_LOG_SIZE = 5  # Slowest queries kept per request, 0 disables call-site tracking
+PERFORMANCE_METRICS_IPS = ['127.0.0.1']  # Clients allowed to scrape /metrics
+
 # For development
 CORS_ALLOW_ALL_ORIGINS = True  # Be cautious with this in production
 
@@ -96,7 +102,7 @@ WSGI_APPLICATION = 'anharapp.wsgi.application'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',  # For simple token auth
-        'rest_framework_simplejwt.authentication.JWTAuthentication',  # For JWT
+        'myapp.authentication.ClaimsJWTAuthentication',  # For JWT, builds the user from the token claims
     ],
 }
 
@@ -105,6 +111,35 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),     # Refresh token expiration duration
 }
 
+# Seconds a user's active flag is cached by ClaimsJWTAuthentication, 0 trusts the token alone
+JWT_USER_CACHE_TTL = 30
+
+# Bottle QR codes are rendered in a background process pool instead of on the request thread
+QR_CODE_ASYNC = True
+QR_CODE_WORKERS = 2
+QR_CODE_BATCH_SIZE = 200  # Bottles written back per bulk update
+QR_CODE_CACHE_DIR = BASE_DIR / 'qr_cache'  # Content-addressed cache served by the QR image endpoints
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Customer order lists, shared by every worker in production, e.g.
+    # 'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379/1'
+    'orders': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'orders',
+    },
+}
+ORDERS_CACHE_ALIAS = 'orders'
+ORDERS_CACHE_TTL = 600  # Seconds, writes invalidate the affected customer earlier
+
+# Seconds the dashboard KPI snapshot is cached, writes through the ORM invalidate it earlier
+DASHBOARD_KPI_TTL = 300
+
+# Seconds other worker processes may keep using a changed special price or price list, see inventory.pricing
+PRICING_CACHE_TTL = 60
+
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
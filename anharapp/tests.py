@@ -0,0 +1,67 @@
+import re
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from anharapp.metrics import RequestMetrics, registry
+from myapp.models import CustomUser, UserTypes
+
+
+class PerformanceMiddlewareTests(TestCase):
+    """
+    Requests report their timings in a Server-Timing header and in the /metrics histograms.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'pass', type=UserTypes.Admin)
+
+    def get_client(self):
+        # The middleware reads its settings when the client loads it
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        return client
+
+    def test_server_timing(self):
+        response = self.get_client().get('/bottles/')
+        self.assertRegex(response['Server-Timing'],
+                         r'^db;dur=\d+\.\d;desc="1 queries", serializer;dur=\d+\.\d, total;dur=\d+\.\d$')
+
+    def test_histograms(self):
+        def request_count():
+            match = re.search(r'^anharapp_db_queries_count\{view="bottle-list-create"\} (\d+)$', registry.render(),
+                              re.MULTILINE)
+            return int(match.group(1)) if match else 0
+
+        count = request_count()
+        self.get_client().get('/bottles/')
+        self.assertEqual(request_count(), count + 1)
+
+    def test_metrics_ip_gate(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.get('/metrics', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4')
+        self.assertIn(b'# TYPE anharapp_request_duration_seconds histogram', response.content)
+
+    @override_settings(PERFORMANCE_SLOW_REQUEST_MS=0)
+    def test_slow_request_logged(self):
+        with self.assertLogs('anharapp.performance', 'WARNING') as logs:
+            self.get_client().get('/bottles/')
+        self.assertIn('Slow request GET /bottles/ (bottle-list-create)', logs.output[0])
+        self.assertIn(' at myapp/pagination.py:', logs.output[0])
+
+    def test_call_site_only_for_slowest_queries(self):
+        metrics = RequestMetrics(slow_query_log_size=2)
+        durations = [5, 4, 1, 1, 9]
+        clock = [value for duration in durations for value in (0, duration)]
+        with mock.patch('anharapp.metrics.time.perf_counter', side_effect=clock), \
+                mock.patch('anharapp.metrics._call_site', return_value='here') as call_site:
+            for _ in durations:
+                metrics.record_query(lambda *args: None, 'SELECT 1', (), False, {})
+        self.assertEqual(call_site.call_count, 3)
+        self.assertEqual(sorted(duration for duration, *_ in metrics.slowest_queries), [5, 9])
+        self.assertEqual((metrics.query_count, metrics.db_time), (5, 20))
@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from inventory.models import Bottle, BottleOrder, BottleStatus, Orders
+from myapp.models import PaymentRollup, RollupPeriod
+
+KPI_CACHE_KEY = 'dashboard:kpis'
+
+
+def compute_kpis():
+    """
+    Compute every dashboard figure, with one query per table or rollup.
+    """
+    total_orders = Orders.objects.count()
+    # Calculate the total number of bottles across all orders
+    total_order_bottles = BottleOrder.objects.count()
+    # Calculate average bottles per order if there are any orders
+    avg_bottles_per_order = total_order_bottles / total_orders if total_orders > 0 else 0
+
+    # The payment figures come from the per-day and per-month rollups instead of the raw payments
+    days = PaymentRollup.objects.filter(period=RollupPeriod.DAY).values('period_start').annotate(
+        total=Sum('total'), count=Sum('count')
+    ).order_by()
+    months = PaymentRollup.objects.filter(period=RollupPeriod.MONTH).values('period_start').annotate(
+        total=Sum('total'), count=Sum('count')
+    ).order_by()
+    total_payment = 0
+    daily_averages = []
+    for day in days:
+        total_payment += day['count']
+        daily_averages.append(day['total'] / day['count'])
+    monthly_averages = [month['total'] / month['count'] for month in months]
+
+    # Calculate bottles by status
+    status_dict = dict(Bottle.objects.order_by().values_list('bottle_status').annotate(count=Count('bottleId')))
+
+    # Get the top five customers with the highest number of orders
+    top_customers = list(Orders.objects.values('customer__username').annotate(
+        order_count=Count('id')
+    ).order_by('-order_count')[:5])
+
+    return {
+        'total_orders': total_orders,
+        'avg_bottles_per_order': avg_bottles_per_order.__ceil__(),
+        'total_payment': total_payment,
+        'avg_payment_per_day': sum(daily_averages) / len(daily_averages) if daily_averages else 0,
+        'avg_payment_per_month': sum(monthly_averages) / len(monthly_averages) if monthly_averages else 0,
+        'total_bottles': sum(status_dict.values()),
+        'available_bottles': status_dict.get(BottleStatus.AVAILABLE, 0),
+        'sold_bottles': status_dict.get(BottleStatus.SOLD, 0),
+        'discarded_bottles': status_dict.get(BottleStatus.DISCARDED, 0),
+        'top_customers': top_customers,
+    }
+
+
+def get_kpis():
+    """
+    Return the cached dashboard figures, computing them on a cache miss.
+    """
+    return cache.get_or_set(KPI_CACHE_KEY, compute_kpis, getattr(settings, 'DASHBOARD_KPI_TTL', 300))
+
+
+def invalidate_kpis():
+    cache.delete(KPI_CACHE_KEY)
+
+
+def invalidate_kpis_on_commit():
+    """
+    Drop the cached dashboard figures once the current transaction commits. Called by the bulk
+    write paths, which send no model signals.
+    """
+    transaction.on_commit(invalidate_kpis)
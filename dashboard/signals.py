@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from dashboard.kpis import invalidate_kpis_on_commit
+from inventory.models import Bottle, Orders
+from myapp.models import Payment
+
+
+@receiver([post_save, post_delete], sender=Orders)
+@receiver([post_save, post_delete], sender=Payment)
+@receiver([post_save, post_delete], sender=Bottle)
+def invalidate_dashboard_kpis(sender, **kwargs):
+    # Bulk writes (update/bulk_create) send no signal, their code paths invalidate the figures themselves
+    invalidate_kpis_on_commit()
@@ -1,3 +1,120 @@
+import re
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from dashboard.kpis import KPI_CACHE_KEY, get_kpis
+from dashboard.views import OrderListView
+from inventory import pricing
+from inventory.models import Bottle, OrderStatus, Orders
+from myapp.models import Address, CustomUser, Payment, UserTypes
+
+
+class DashboardTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'pass', type=UserTypes.Admin,
+                                                   is_staff=True)
+        cls.customer = CustomUser.objects.create_user('customer', 'customer@example.com', 'pass',
+                                                      type=UserTypes.CUSTOMER, specialBottlePrice=0)
+        cls.address = Address.objects.create(title='home', user=cls.customer)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(pricing.reset)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create_order(self, order_status=OrderStatus.PENDING):
+        return Orders.objects.create(order_quantity=2, customer=self.customer, address=self.address,
+                                     order_status=order_status)
+
+
+class KPIInvalidationTests(DashboardTestCase):
+    """
+    The cached dashboard figures are dropped by the bulk write paths, not only by model signals.
+    """
+
+    def test_status_change(self):
+        order = self.create_order()
+        get_kpis()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/orders/change-status/',
+                                         {'order_id': order.pk, 'new_order_status': 'approved'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(cache.get(KPI_CACHE_KEY))
+
+    def test_import(self):
+        self.assertEqual(get_kpis()['total_orders'], 0)
+        upload = SimpleUploadedFile('orders.csv', f'customer,address,order_quantity\n'
+                                                  f'{self.customer.pk},{self.address.pk},2\n'.encode())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/orders/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(get_kpis()['total_orders'], 1)
+
+    def test_add_bottles(self):
+        order = self.create_order(OrderStatus.APPROVED)
+        bottle = Bottle.objects.create()
+        self.assertEqual(get_kpis()['sold_bottles'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/bottles/add-bottles-to-order/',
+                                        {'order_id': order.pk, 'bottle_ids': [bottle.pk]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(get_kpis()['sold_bottles'], 1)
+
+
+class DashboardListTests(DashboardTestCase):
+    """
+    The dashboard lists are paginated with a fixed number of queries, or streamed in full with ?stream=1.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def create_orders(self, count):
+        Orders.objects.bulk_create([Orders(order_quantity=2, customer=self.customer, address=self.address)
+                                    for _ in range(count)])
+
+    @staticmethod
+    def row_ids(content):
+        return [int(pk) for pk in re.findall(r'<tr>\s*<td>(\d+)</td>', content)]
+
+    def test_page_size(self):
+        self.create_orders(60)
+        response = self.client.get('/dashboard/orders')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['orders']), 50)
+        self.assertEqual(response.context['paginator'].count, 60)
+        self.assertEqual(len(self.row_ids(response.content.decode())), 50)
+
+    def test_query_count(self):
+        # The session, its user, the count and the page joined with the customers
+        for count in (1, 60):
+            self.create_orders(count)
+            with self.assertNumQueries(4):
+                self.client.get('/dashboard/orders')
+            Payment.objects.bulk_create([Payment(amount=1, customer=self.customer, receiver=self.admin)
+                                         for _ in range(count)])
+            with self.assertNumQueries(4):
+                self.client.get('/dashboard/payment')
+
+    def test_stream(self):
+        self.create_orders(60)
+        with mock.patch.object(OrderListView, 'stream_chunk_size', 7):
+            response = self.client.get('/dashboard/orders?stream=1')
+            self.assertTrue(response.streaming)
+            self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+            content = b''.join(response.streaming_content).decode()
+        self.assertEqual(self.row_ids(content),
+                         list(Orders.objects.order_by('-order_date').values_list('pk', flat=True)))
+        self.assertTrue(content.rstrip().endswith('</html>'))
 
-# Create your tests here.
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get('/dashboard/orders')
+        self.assertEqual(response.status_code, 302)
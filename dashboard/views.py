@@ -1,10 +1,11 @@
 from django.contrib.auth.mixins import UserPassesTestMixin
-from django.db.models import Avg, Count
-from django.db.models.functions import TruncDay, TruncMonth
+from django.http import StreamingHttpResponse
+from django.template.loader import render_to_string
 from django.urls import reverse_lazy
 from django.views.generic import TemplateView, ListView
 from inventory.models import *
 from myapp.models import *
+from .kpis import get_kpis
 
 
 # Create your views here.
@@ -17,78 +18,52 @@ class IndexView(UserPassesTestMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-
-        # Calculate the total number of orders
-        total_orders = Orders.objects.count()
-
-        # Calculate the total number of bottles across all orders
-        total_bottles = BottleOrder.objects.count()
-
-        # Calculate average bottles per order if there are any orders
-        if total_orders > 0:
-            avg_bottles_per_order = total_bottles / total_orders
-        else:
-            avg_bottles_per_order = 0
-
-        context['total_orders'] = total_orders
-        context['avg_bottles_per_order'] = avg_bottles_per_order.__ceil__()
-
-        total_payment = Payment.objects.count()
-
-        context['total_payment'] = total_payment
-
-        # Calculate average payment per day
-        payments_per_day = Payment.objects.annotate(day=TruncDay('created_at')).values('day').annotate(
-            avg_daily=Avg('amount')).order_by('day')
-
-        # for x in payments_per_day:
-        #     print(x)
-
-        if payments_per_day:
-            total_avg_per_day = sum(item['avg_daily'] for item in payments_per_day) / len(payments_per_day)
-        else:
-            total_avg_per_day = 0
-
-        # Calculate average payment per month
-        payments_per_month = Payment.objects.annotate(month=TruncMonth('created_at')).values('month').annotate(
-            avg_monthly=Avg('amount')).order_by('month')
-        if payments_per_month:
-            total_avg_per_month = sum(item['avg_monthly'] for item in payments_per_month) / len(payments_per_month)
-        else:
-            total_avg_per_month = 0
-
-        context['avg_payment_per_day'] = total_avg_per_day
-        context['avg_payment_per_month'] = total_avg_per_month
-
-        # Calculate the total number of bottles
-        total_bottles = Bottle.objects.count()
-
-        # Calculate bottles by status
-        bottles_by_status = Bottle.objects.values('bottle_status').annotate(count=Count('bottle_status'))
-        # print(bottles_by_status)
-        status_dict = {status['bottle_status']: status['count'] for status in bottles_by_status}
-        # print(status_dict)
-
-        # Assigning counts to context
-        context['total_bottles'] = total_bottles
-        context['available_bottles'] = status_dict.get(BottleStatus.AVAILABLE, 0)
-        context['sold_bottles'] = status_dict.get(BottleStatus.SOLD, 0)
-        context['discarded_bottles'] = status_dict.get(BottleStatus.DISCARDED, 0)
-
-        # Get the top five customers with the highest number of orders
-        top_customers = Orders.objects.values('customer__username').annotate(
-            order_count=Count('id')
-        ).order_by('-order_count')[:5]
-
-        context['top_customers'] = top_customers
-
+        # Served from the cached KPI snapshot, see dashboard.kpis
+        context.update(get_kpis())
         return context
 
 
-class PaymentListView(UserPassesTestMixin , ListView):
+class StreamingListMixin:
+    """
+    Serve the whole list as a stream when ?stream=1 is given: the page around the table is
+    rendered once and the rows follow chunk by chunk from a server-side cursor, so a full table
+    never has to be held in memory.
+    """
+    rows_template_name = None
+    stream_chunk_size = 500
+    rows_marker = '<!-- rows -->'
+
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('stream') != '1':
+            return super().get(request, *args, **kwargs)
+        return StreamingHttpResponse(self.stream_rows(), content_type='text/html; charset=utf-8')
+
+    def stream_rows(self):
+        self.object_list = self.model.objects.none()
+        page = render_to_string(self.template_name, self.get_context_data(streaming=True), self.request)
+        head, tail = page.split(self.rows_marker, 1)
+        yield head
+
+        chunk = []
+        for obj in self.get_queryset().iterator(chunk_size=self.stream_chunk_size):
+            chunk.append(obj)
+            if len(chunk) >= self.stream_chunk_size:
+                yield self.render_rows(chunk)
+                chunk = []
+        if chunk:
+            yield self.render_rows(chunk)
+        yield tail
+
+    def render_rows(self, rows):
+        return render_to_string(self.rows_template_name, {self.context_object_name: rows}, self.request)
+
+
+class PaymentListView(UserPassesTestMixin, StreamingListMixin, ListView):
     model = Payment
     template_name = 'dashboard/payment.html'
+    rows_template_name = 'dashboard/partials/payment_rows.html'
     context_object_name = 'payments'
+    paginate_by = 50
 
     login_url = reverse_lazy('admin:login')
 
@@ -96,13 +71,15 @@ class PaymentListView(UserPassesTestMixin , ListView):
         return self.request.user.is_authenticated
 
     def get_queryset(self):
-        return Payment.objects.all().order_by('-created_at')
+        return Payment.objects.select_related('customer', 'receiver').order_by('-created_at')
 
 
-class OrderListView(UserPassesTestMixin ,ListView):
+class OrderListView(UserPassesTestMixin, StreamingListMixin, ListView):
     model = Orders
     template_name = 'dashboard/orders.html'
+    rows_template_name = 'dashboard/partials/order_rows.html'
     context_object_name = 'orders'
+    paginate_by = 50
 
     login_url = reverse_lazy('admin:login')
 
@@ -110,18 +87,20 @@ class OrderListView(UserPassesTestMixin ,ListView):
         return self.request.user.is_authenticated
 
     def get_queryset(self):
-        return Orders.objects.all().order_by('-order_date')
+        return Orders.objects.select_related('customer').order_by('-order_date')
 
 
-class BottlesListView(UserPassesTestMixin,ListView):
+class BottlesListView(UserPassesTestMixin, StreamingListMixin, ListView):
     model = Bottle
     template_name = 'dashboard/bottles.html'
+    rows_template_name = 'dashboard/partials/bottle_rows.html'
     context_object_name = 'bottles'
+    paginate_by = 50
     login_url = reverse_lazy('admin:login')
 
     def test_func(self):
         return self.request.user.is_authenticated
 
-
     def get_queryset(self):
-        return Bottle.objects.all()
\ No newline at end of file
+        # The stored QR code is never shown here
+        return Bottle.objects.defer('qr_code').order_by('bottleId')
@@ -1,8 +1,20 @@
 from django.contrib import admin
 
-from inventory.models import Bottle, Orders
+from inventory.models import Bottle, Orders, PriceList, PriceTier
 
 # Register your models here.
 
 admin.site.register(Bottle)
 admin.site.register(Orders)
+
+
+class PriceTierInline(admin.TabularInline):
+    model = PriceTier
+    extra = 1
+
+
+@admin.register(PriceList)
+class PriceListAdmin(admin.ModelAdmin):
+    list_display = ('effective_from', 'price_per_bottle')
+    inlines = [PriceTierInline]
+
@@ -0,0 +1,382 @@
+"""
+Synthetic dataset and API benchmark used by the seed_benchmark_data and benchmark_api commands.
+
+Both commands write to whatever database the settings point at, so run them against a dedicated
+database (SQLite file, local MySQL or Postgres) and never against production data.
+"""
+import datetime
+import random
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import F, Max, QuerySet
+from django.test import Client
+from django.utils import timezone
+
+from inventory import pricing
+from inventory.models import (ORDER_STATUS_PRIORITY, Bottle, BottleEvent, BottleEventType, BottleOrder, BottleStatus,
+                              OrderStatus, Orders, QRCodeStatus)
+from myapp.models import Address, CustomUser, Payment, UserTypes
+
+PREFIX = 'bench-'
+PASSWORD = 'benchmark-password'
+BOTTLES_PER_ORDER = 2
+BULK_CHANGE_SIZE = 20
+
+# Share of the seeded orders in each status, most orders of a long-running shop are delivered
+STATUS_WEIGHTS = {OrderStatus.PENDING: 10, OrderStatus.APPROVED: 10, OrderStatus.DELIVERED: 70,
+                  OrderStatus.CANCELLED: 10}
+
+
+def batched(objs, size):
+    for start in range(0, len(objs), size):
+        yield objs[start:start + size]
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    # Let bulk_create keep the dates we generate instead of stamping every row with now()
+    saved = [(field, field.auto_now_add) for field in fields]
+    for field, _ in saved:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now_add in saved:
+            field.auto_now_add = auto_now_add
+
+
+def bulk_create_ids(model, objs, batch_size):
+    # MySQL does not return the ids of bulk inserted rows; the benchmark is the only writer, so
+    # everything above the previous maximum id is ours
+    last_id = model.objects.aggregate(last=Max('pk'))['last'] or 0
+    for batch in batched(objs, batch_size):
+        model.objects.bulk_create(batch)
+    return list(model.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True))
+
+
+class Factory:
+    """
+    Builds benchmark rows in bulk. Customers are (customer id, address id) pairs.
+    """
+
+    def __init__(self, seed=0, days=365, batch_size=5000):
+        self.rng = random.Random(seed)
+        self.days = days
+        self.batch_size = batch_size
+        self.now = timezone.now()
+
+    def random_date(self):
+        return self.now - datetime.timedelta(seconds=self.rng.randrange(self.days * 86400))
+
+    def create_users(self, count, user_type, name):
+        password = make_password(PASSWORD)  # Hashing once keeps seeding fast, every user shares it
+        users = []
+        for index in range(count):
+            username = f'{PREFIX}{name}-{index}'
+            special_price = Decimal(self.rng.choice((15, 18))) if name == 'customer' and index % 10 == 0 else None
+            users.append(CustomUser(username=username, email=f'{username}@example.com', password=password,
+                                    type=user_type, phone_number=f'05{index:08d}', specialBottlePrice=special_price))
+        return bulk_create_ids(CustomUser, users, self.batch_size)
+
+    def create_addresses(self, customer_ids):
+        bulk_create_ids(Address, [Address(title=f'Street {index}', user_id=customer_id)
+                                  for index, customer_id in enumerate(customer_ids)], self.batch_size)
+
+    def build_order(self, customer, status, quantity, receiver_ids):
+        customer_id, address_id = customer
+        order = Orders(customer_id=customer_id, address_id=address_id, order_quantity=quantity,
+                       order_status=status, status_priority=ORDER_STATUS_PRIORITY[status],
+                       order_date=self.random_date())
+        order.total_price = pricing.get_order_price(customer_id, quantity, order.order_date.date())
+        if status != OrderStatus.PENDING and receiver_ids:
+            order.receiver_id = self.rng.choice(receiver_ids)
+        if status == OrderStatus.DELIVERED:
+            order.delivery_date = order.order_date.date()
+        return order
+
+    def create_orders(self, customers, count, receiver_ids, status=None, quantity=None):
+        statuses, weights = zip(*STATUS_WEIGHTS.items())
+        orders = [
+            self.build_order(self.rng.choice(customers), status or self.rng.choices(statuses, weights)[0],
+                             quantity or self.rng.randint(1, 10), receiver_ids)
+            for _ in range(count)
+        ]
+        with explicit_timestamps(Orders._meta.get_field('order_date')):
+            return bulk_create_ids(Orders, orders, self.batch_size)
+
+    def create_bottles(self, count, status=BottleStatus.AVAILABLE):
+        # The labels are irrelevant here, Bottle.save (and its QR rendering) is skipped by bulk_create
+        return bulk_create_ids(Bottle, [
+            Bottle(bottle_status=status, number_of_times_Sold=self.rng.randrange(30), qr_code_status=QRCodeStatus.PENDING)
+            for _ in range(count)
+        ], self.batch_size)
+
+    def create_payments(self, customers, count, receiver_ids):
+        # Inserted past PaymentQuerySet.bulk_create: updating a rollup bucket per payment is far slower
+        # than adding the wallets up here and rebuilding the rollups once the payments are in
+        created = 0
+        amounts = {}
+        with explicit_timestamps(Payment._meta.get_field('created_at')):
+            for start in range(0, count, self.batch_size):
+                payments = []
+                for _ in range(min(self.batch_size, count - start)):
+                    customer_id, _ = self.rng.choice(customers)
+                    # Top-ups by staff and charges for delivered bottles
+                    if self.rng.random() < 0.5:
+                        amount, receiver_id = Decimal(self.rng.choice((50, 100, 200))), self.rng.choice(receiver_ids)
+                    else:
+                        amount, receiver_id = -pricing.get_order_price(customer_id, self.rng.randint(1, 10)), None
+                    payments.append(Payment(customer_id=customer_id, receiver_id=receiver_id, amount=amount,
+                                            created_at=self.random_date()))
+                    amounts[customer_id] = amounts.get(customer_id, 0) + amount
+                created += len(QuerySet(Payment).bulk_create(payments))
+        CustomUser.add_to_wallets(amounts)
+        call_command('backfill_payment_rollups', batch_size=self.batch_size, stdout=StringIO())
+        return created
+
+
+def benchmark_customers(limit=None):
+    customers = CustomUser.objects.filter(username__startswith=f'{PREFIX}customer-', addresses__isnull=False)
+    customers = customers.annotate(address_id=F('addresses__pk')).only('specialBottlePrice').order_by('pk')
+    customers = list(customers[:limit] if limit else customers)
+    pricing.prime_customers(customers)
+    return [(customer.pk, customer.address_id) for customer in customers]
+
+
+def seed(customers, employees, orders, bottles, payments, seed=0, days=365, batch_size=5000, log=print):
+    factory = Factory(seed, days, batch_size)
+
+    employee_ids = factory.create_users(1, UserTypes.Admin, 'employee')
+    employee_ids += factory.create_users(max(employees - 1, 0), UserTypes.DRIVER, 'driver')
+    log(f'{len(employee_ids)} employees')
+    customer_ids = factory.create_users(customers, UserTypes.CUSTOMER, 'customer')
+    factory.create_addresses(customer_ids)
+    log(f'{len(customer_ids)} customers with an address')
+
+    customer_rows = benchmark_customers()
+    for start in range(0, orders, batch_size):
+        factory.create_orders(customer_rows, min(batch_size, orders - start), employee_ids)
+        log(f'{min(start + batch_size, orders)} orders')
+    log(f'{len(factory.create_bottles(bottles))} bottles')
+    log(f'{factory.create_payments(customer_rows, payments, employee_ids)} payments')
+
+
+class BenchmarkRunner:
+    """
+    Replays each scenario's requests through the Django test client and records latency,
+    throughput and the per-request query count and database time from the Server-Timing header
+    set by anharapp.metrics.PerformanceMiddleware.
+    """
+    scenarios = ('login', 'orders-list', 'customer-orders-list', 'orders-create', 'change-status', 'change-status-bulk',
+                 'add-bottles', 'return-bottles', 'bottle-history', 'outstanding-bottles', 'payments-list',
+                 'payments-create', 'dashboard', 'dashboard-orders')
+
+    server_timing_re = re.compile(r'db;dur=(?P<db>[\d.]+);desc="(?P<queries>\d+) queries", serializer;dur=(?P<serializer>[\d.]+)')
+
+    def __init__(self, iterations=50, warmup=2, concurrency=1, host='localhost', seed=0):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.concurrency = concurrency
+        self.host = host
+        self.factory = Factory(seed, days=1)
+        self.local = threading.local()
+
+        self.customers = benchmark_customers(limit=100)
+        self.employee = CustomUser.objects.filter(username=f'{PREFIX}employee-0').first()
+        if not self.customers or self.employee is None:
+            raise ValueError('No benchmark data, run seed_benchmark_data first.')
+        self.customer = CustomUser.objects.get(pk=self.customers[0][0])
+
+        # Log in once through the API, the scenarios then authenticate with the issued JWTs
+        self.tokens = {'employee': self.login_token(self.employee), 'customer': self.login_token(self.customer)}
+        client = Client(HTTP_HOST=host)
+        client.force_login(self.employee)
+        self.session_cookies = client.cookies
+
+    def login_token(self, user):
+        response = Client(HTTP_HOST=self.host).post('/users/login/', {'username': user.username, 'password': PASSWORD},
+                                                    content_type='application/json')
+        if response.status_code != 200:
+            raise ValueError(f'Logging in as {user.username} failed with status {response.status_code}, '
+                             f'is {self.host} in ALLOWED_HOSTS?')
+        return response.json()['token']
+
+    def get_client(self):
+        # Test clients keep cookies, so every worker thread gets its own
+        if not hasattr(self.local, 'client'):
+            self.local.client = Client(HTTP_HOST=self.host)
+            self.local.client.cookies.update(self.session_cookies)
+        return self.local.client
+
+    def send(self, request):
+        method, path, data, auth, expected_status = request
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {self.tokens[auth]}'} if auth in self.tokens else {}
+        client = self.get_client()
+        start = time.perf_counter()
+        if method == 'get':
+            response = client.get(path, data, **headers)
+        else:
+            response = getattr(client, method)(path, data, content_type='application/json', **headers)
+        elapsed = time.perf_counter() - start
+        if self.concurrency > 1:
+            connections.close_all()
+        timing = self.server_timing_re.search(response.get('Server-Timing', ''))
+        return elapsed, response.status_code == expected_status, timing and timing.groupdict()
+
+    def run(self, names=None):
+        return {name: self.run_scenario(name) for name in names or self.scenarios}
+
+    def run_scenario(self, name):
+        requests = getattr(self, f"prepare_{name.replace('-', '_')}")(self.warmup + self.iterations)
+        for request in requests[:self.warmup]:
+            self.send(request)
+
+        start = time.perf_counter()
+        if self.concurrency > 1:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                results = list(pool.map(self.send, requests[self.warmup:]))
+        else:
+            results = [self.send(request) for request in requests[self.warmup:]]
+        total = time.perf_counter() - start
+        return self.summarize(results, total)
+
+    @staticmethod
+    def summarize(results, total):
+        latencies = sorted(elapsed * 1000 for elapsed, _, _ in results)
+        timings = [timing for _, _, timing in results if timing]
+        percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+        summary = {
+            'requests': len(results),
+            'errors': sum(not ok for _, ok, _ in results),
+            'throughput_rps': round(len(results) / total, 2) if total else None,
+            'mean_ms': round(statistics.fmean(latencies), 2),
+            'p50_ms': round(percentiles[49], 2),
+            'p95_ms': round(percentiles[94], 2),
+            'p99_ms': round(percentiles[98], 2),
+            'max_ms': round(latencies[-1], 2),
+            'queries': None, 'max_queries': None, 'db_ms': None, 'serializer_ms': None,
+        }
+        if timings:
+            summary.update(
+                queries=statistics.median_low(int(timing['queries']) for timing in timings),
+                max_queries=max(int(timing['queries']) for timing in timings),
+                db_ms=round(statistics.fmean(float(timing['db']) for timing in timings), 2),
+                serializer_ms=round(statistics.fmean(float(timing['serializer']) for timing in timings), 2),
+            )
+        return summary
+
+    # Every prepare_* method returns the (method, path, data, auth, expected status) requests of a scenario
+
+    def prepare_login(self, count):
+        return [('post', '/users/login/', {'username': self.customer.username, 'password': PASSWORD}, None, 200)] * count
+
+    def prepare_orders_list(self, count):
+        return [('get', '/orders/', {}, 'employee', 200)] * count
+
+    def prepare_customer_orders_list(self, count):
+        return [('get', f'/orders/customer/{self.customer.pk}', {}, 'customer', 200)] * count
+
+    def prepare_orders_create(self, count):
+        return [
+            ('post', '/orders/', {'customer': customer_id, 'address': address_id, 'order_quantity': BOTTLES_PER_ORDER},
+             'employee', 201)
+            for customer_id, address_id in (self.customers[index % len(self.customers)] for index in range(count))
+        ]
+
+    def prepare_change_status(self, count):
+        order_ids = self.factory.create_orders(self.customers, count, [self.employee.pk], status=OrderStatus.PENDING)
+        return [('patch', '/orders/change-status/', {'order_id': order_id, 'new_order_status': 'APPROVED'},
+                 'employee', 200) for order_id in order_ids]
+
+    def prepare_change_status_bulk(self, count):
+        # Dispatch batches delivering BULK_CHANGE_SIZE orders each
+        order_ids = self.factory.create_orders(self.customers, count * BULK_CHANGE_SIZE, [self.employee.pk],
+                                               status=OrderStatus.APPROVED)
+        return [
+            ('patch', '/orders/change-status/bulk/',
+             {'changes': [{'order_id': order_id, 'new_order_status': 'DELIVERED'}
+                          for order_id in order_ids[index * BULK_CHANGE_SIZE:(index + 1) * BULK_CHANGE_SIZE]]},
+             'employee', 200)
+            for index in range(count)
+        ]
+
+    def prepare_add_bottles(self, count):
+        order_ids = self.factory.create_orders(self.customers, count, [self.employee.pk], status=OrderStatus.APPROVED,
+                                               quantity=BOTTLES_PER_ORDER)
+        bottle_ids = self.factory.create_bottles(count * BOTTLES_PER_ORDER)
+        return [
+            ('post', '/bottles/add-bottles-to-order/',
+             {'order_id': order_id, 'bottle_ids': bottle_ids[index * BOTTLES_PER_ORDER:(index + 1) * BOTTLES_PER_ORDER]},
+             'employee', 201)
+            for index, order_id in enumerate(order_ids)
+        ]
+
+    def prepare_return_bottles(self, count):
+        order_ids = self.factory.create_orders(self.customers, count, [self.employee.pk], status=OrderStatus.DELIVERED,
+                                               quantity=BOTTLES_PER_ORDER)
+        bottle_ids = self.factory.create_bottles(count * BOTTLES_PER_ORDER, status=BottleStatus.SOLD)
+        bottle_orders = [BottleOrder(order_id=order_id, bottle_id=bottle_id)
+                         for index, order_id in enumerate(order_ids)
+                         for bottle_id in bottle_ids[index * BOTTLES_PER_ORDER:(index + 1) * BOTTLES_PER_ORDER]]
+        BottleOrder.objects.bulk_create(bottle_orders, batch_size=self.factory.batch_size)
+        # Keep the counters the return flow decrements in step with the bottle orders created here
+        outstanding = {}
+        for customer_id in Orders.objects.filter(pk__in=order_ids).values_list('customer_id', flat=True):
+            outstanding[customer_id] = outstanding.get(customer_id, 0) + BOTTLES_PER_ORDER
+        CustomUser.add_outstanding_bottles(outstanding)
+        return [
+            ('post', '/bottles/return-bottles/',
+             {'bottle_ids': bottle_ids[index * BOTTLES_PER_ORDER:(index + 1) * BOTTLES_PER_ORDER]}, 'employee', 200)
+            for index in range(count)
+        ]
+
+    def prepare_bottle_history(self, count):
+        # A bottle that has been through the full cycle ten times
+        bottle_id, = self.factory.create_bottles(1)
+        events = [BottleEvent(bottle_id=bottle_id, event=event, timestamp=self.factory.random_date())
+                  for _ in range(10) for event in (BottleEventType.ISSUED, BottleEventType.DELIVERED,
+                                                   BottleEventType.RETURNED)]
+        BottleEvent.objects.bulk_create(events)
+        return [('get', f'/bottles/{bottle_id}/history', {}, 'employee', 200)] * count
+
+    def prepare_outstanding_bottles(self, count):
+        return [('get', '/customers/outstanding-bottles/', {}, 'employee', 200)] * count
+
+    def prepare_payments_list(self, count):
+        return [('get', '/payments/', {}, 'employee', 200)] * count
+
+    def prepare_payments_create(self, count):
+        return [('post', '/payments/', {'customer': self.customers[index % len(self.customers)][0], 'amount': '50.00'},
+                 'employee', 201) for index in range(count)]
+
+    def prepare_dashboard(self, count):
+        return [('get', '/dashboard/', {}, 'session', 200)] * count
+
+    def prepare_dashboard_orders(self, count):
+        return [('get', '/dashboard/orders', {}, 'session', 200)] * count
+
+
+def dataset_summary():
+    return {
+        'users': CustomUser.objects.count(),
+        'addresses': Address.objects.count(),
+        'orders': Orders.objects.count(),
+        'bottles': Bottle.objects.count(),
+        'bottle_orders': BottleOrder.objects.count(),
+        'bottle_events': BottleEvent.objects.count(),
+        'payments': Payment.objects.count(),
+    }
+
+
+def database_summary():
+    return {'vendor': connection.vendor, 'version': '.'.join(map(str, connection.get_database_version()))}
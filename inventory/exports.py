@@ -0,0 +1,87 @@
+import csv
+import datetime
+import json
+
+from django.utils import timezone
+
+from inventory.models import BottleOrder, Orders
+from myapp.models import Payment
+
+# Columns of every exportable table, with the fields the date range and customer filters apply to
+EXPORTS = {
+    'payments': {
+        'model': Payment,
+        'fields': ('id', 'created_at', 'amount', 'customer_id', 'receiver_id'),
+        'date_field': 'created_at',
+        'customer_field': 'customer_id',
+    },
+    'orders': {
+        'model': Orders,
+        'fields': ('id', 'order_date', 'order_status', 'order_quantity', 'total_price', 'customer_id', 'address_id',
+                   'receiver_id', 'delivery_date'),
+        'date_field': 'order_date',
+        'customer_field': 'customer_id',
+    },
+    'bottle-orders': {
+        'model': BottleOrder,
+        'fields': ('id', 'order_id', 'bottle_id', 'order__order_date', 'order__customer_id', 'dateOfReturning'),
+        'date_field': 'order__order_date',
+        'customer_field': 'order__customer_id',
+    },
+}
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def export_rows(dataset, date_from=None, date_to=None, customer_id=None, chunk_size=2000):
+    """
+    Return the header and a lazy iterator over the rows of an export. Rows are read as plain
+    tuples in chunks, so memory stays constant however large the table is.
+    """
+    export = EXPORTS[dataset]
+    queryset = export['model'].objects.order_by('pk')
+    # Filter on datetime bounds rather than __date so the date column's index can be used
+    if date_from:
+        start = timezone.make_aware(datetime.datetime.combine(date_from, datetime.time.min))
+        queryset = queryset.filter(**{f"{export['date_field']}__gte": start})
+    if date_to:
+        end = timezone.make_aware(datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time.min))
+        queryset = queryset.filter(**{f"{export['date_field']}__lt": end})
+    if customer_id:
+        queryset = queryset.filter(**{export['customer_field']: customer_id})
+
+    rows = queryset.values_list(*export['fields']).iterator(chunk_size=chunk_size)
+    return export['fields'], rows
+
+
+class _Echo:
+    # csv.writer only needs write(), hand every line straight back instead of buffering it
+    def write(self, value):
+        return value
+
+
+def stream_csv(header, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def stream_ndjson(header, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(header, row)), default=_json_value) + '\n'
+
+
+def stream_export(dataset, file_format, **filters):
+    header, rows = export_rows(dataset, **filters)
+    if file_format == 'ndjson':
+        return stream_ndjson(header, rows)
+    return stream_csv(header, rows)
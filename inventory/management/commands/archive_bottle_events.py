@@ -0,0 +1,48 @@
+import datetime
+import gzip
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from inventory.models import BottleEvent
+
+
+class Command(BaseCommand):
+    help = ('Move bottle events older than --days out of the event table, into a gzipped '
+            'newline-delimited JSON archive.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=730, help='Keep the events of the last DAYS days.')
+        parser.add_argument('--output', help='Archive file, defaults to bottle-events-<cutoff date>.ndjson.gz.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help='Only count the events that would be archived.')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+        cutoff = timezone.now() - datetime.timedelta(days=options['days'])
+        # Served by the timestamp index
+        old_events = BottleEvent.objects.filter(timestamp__lt=cutoff).order_by('timestamp', 'id')
+        if options['dry_run']:
+            self.stdout.write(f'{old_events.count()} bottle events before {cutoff:%Y-%m-%d} would be archived')
+            return
+
+        output = options['output'] or f'bottle-events-{cutoff:%Y-%m-%d}.ndjson.gz'
+        archived = 0
+        with gzip.open(output, 'at', encoding='utf-8') as archive:
+            while True:
+                batch = list(old_events.values('id', 'bottle_id', 'event', 'order_id', 'timestamp')[:options['batch_size']])
+                if not batch:
+                    break
+                # The batch is written (and flushed) before it is deleted, so an interrupted run loses nothing
+                for event in batch:
+                    archive.write(json.dumps({**event, 'timestamp': event['timestamp'].isoformat()}) + '\n')
+                archive.flush()
+                with transaction.atomic():
+                    BottleEvent.objects.filter(pk__in=[event['id'] for event in batch]).delete()
+                archived += len(batch)
+                self.stdout.write(f'{archived} events archived')
+
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} bottle events before {cutoff:%Y-%m-%d} to {output}'))
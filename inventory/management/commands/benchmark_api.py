@@ -0,0 +1,80 @@
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from inventory.benchmark import BenchmarkRunner, database_summary, dataset_summary
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the core API endpoints against the seed_benchmark_data dataset and write a JSON report. '
+            'Run it once per database (settings module) and compare the reports release to release.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*',
+                            help=f"Scenarios to run, all of them by default: {', '.join(BenchmarkRunner.scenarios)}.")
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--concurrency', type=int, default=1)
+        parser.add_argument('--host', default='localhost', help='Host header, must be in ALLOWED_HOSTS.')
+        parser.add_argument('--output', help='File to write the JSON report to, defaults to stdout.')
+        parser.add_argument('--baseline', help='Previous report to compare with, regressions fail the command.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed p50 slowdown against the baseline, 0.2 is 20%%.')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('At least one iteration is needed.')
+        unknown = set(options['scenarios']) - set(BenchmarkRunner.scenarios)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        try:
+            runner = BenchmarkRunner(options['iterations'], options['warmup'], options['concurrency'], options['host'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': database_summary(),
+            'dataset': dataset_summary(),
+            'iterations': options['iterations'],
+            'concurrency': options['concurrency'],
+            'scenarios': runner.run(options['scenarios']),
+        }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['baseline']:
+            self.compare(report, options['baseline'], options['tolerance'])
+
+    def compare(self, report, baseline_path, tolerance):
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)['scenarios']
+
+        regressions = []
+        for name, current in report['scenarios'].items():
+            previous = baseline.get(name)
+            if previous is None:
+                continue
+            change = current['p50_ms'] / previous['p50_ms'] - 1 if previous['p50_ms'] else 0
+            self.stderr.write(f"{name}: p50 {previous['p50_ms']} -> {current['p50_ms']} ms ({change:+.0%}), "
+                              f"queries {previous['queries']} -> {current['queries']}")
+            if change > tolerance:
+                regressions.append(f'{name} p50 {change:+.0%}')
+            if current['queries'] is not None and previous['queries'] is not None \
+                    and current['queries'] > previous['queries']:
+                regressions.append(f"{name} queries {previous['queries']} -> {current['queries']}")
+            if current['errors'] > previous['errors']:
+                regressions.append(f"{name} errors {previous['errors']} -> {current['errors']}")
+
+        if regressions:
+            raise CommandError('Regressions against the baseline: ' + ', '.join(regressions))
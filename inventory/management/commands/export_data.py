@@ -0,0 +1,34 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.exports import EXPORTS, EXPORT_FORMATS, stream_export
+
+
+def parse_date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'{value} is not a YYYY-MM-DD date')
+
+
+class Command(BaseCommand):
+    help = 'Stream payments, orders or bottle orders to CSV or newline-delimited JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(EXPORTS))
+        parser.add_argument('--format', dest='file_format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--from', dest='date_from', type=parse_date)
+        parser.add_argument('--to', dest='date_to', type=parse_date)
+        parser.add_argument('--customer', dest='customer_id', type=int)
+        parser.add_argument('--output', help='File to write to, defaults to stdout.')
+
+    def handle(self, *args, **options):
+        lines = stream_export(options['dataset'], options['file_format'], date_from=options['date_from'],
+                              date_to=options['date_to'], customer_id=options['customer_id'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
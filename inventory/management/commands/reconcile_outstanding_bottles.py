@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from inventory.models import BottleOrder
+from myapp.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Rebuild the customers' outstanding bottle counters from the unreturned bottle orders and report any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drift, do not fix it.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # The add and return flows update the counter in the same transaction as the bottle
+            # orders, so once the counters are locked the unreturned bottles can be counted safely
+            users = list(CustomUser.objects.select_for_update().order_by('pk').values_list(
+                'pk', 'username', 'outstanding_bottles'
+            ))
+            counts = dict(
+                BottleOrder.objects.filter(dateOfReturning__isnull=True).order_by().values('order__customer_id')
+                .annotate(count=Count('id')).values_list('order__customer_id', 'count')
+            )
+
+            drifted = []
+            for pk, username, outstanding in users:
+                expected = counts.get(pk, 0)
+                if outstanding != expected:
+                    self.stdout.write(f'{username} (#{pk}): stored {outstanding}, expected {expected}')
+                    drifted.append(CustomUser(pk=pk, outstanding_bottles=expected))
+
+            if drifted and not options['dry_run']:
+                CustomUser.objects.bulk_update(drifted, ['outstanding_bottles'], batch_size=options['batch_size'])
+
+        action = 'found' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'{action} {len(drifted)} drifted outstanding bottle counters'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from inventory import benchmark
+from myapp.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Seed a synthetic dataset for benchmark_api. Use a dedicated database, never production.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=10000)
+        parser.add_argument('--employees', type=int, default=20)
+        parser.add_argument('--orders', type=int, default=1000000)
+        parser.add_argument('--bottles', type=int, default=100000)
+        parser.add_argument('--payments', type=int, default=500000)
+        parser.add_argument('--days', type=int, default=365, help='Spread the orders and payments over this many days.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same dataset.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['customers'] < 1 or options['employees'] < 1:
+            raise CommandError('At least one customer and one employee are needed.')
+        if CustomUser.objects.filter(username__startswith=benchmark.PREFIX).exists():
+            raise CommandError('The benchmark data is already seeded, start from an empty database.')
+
+        with transaction.atomic():
+            benchmark.seed(options['customers'], options['employees'], options['orders'], options['bottles'],
+                           options['payments'], seed=options['seed'], days=options['days'],
+                           batch_size=options['batch_size'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS('Benchmark data seeded'))
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:36
+
+from django.db import migrations, models
+
+
+def mark_existing_qr_codes_ready(apps, schema_editor):
+    Bottle = apps.get_model('inventory', 'Bottle')
+    Bottle.objects.filter(qr_code__isnull=False).exclude(qr_code='').update(qr_code_status='R')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0006_alter_bottle_qr_code'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bottle',
+            name='qr_code_status',
+            field=models.CharField(choices=[('P', 'Pending'), ('R', 'Ready')], default='P', max_length=1),
+        ),
+        migrations.RunPython(mark_existing_qr_codes_ready, migrations.RunPython.noop),
+    ]
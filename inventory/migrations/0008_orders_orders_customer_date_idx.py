@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0007_bottle_qr_code_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='orders',
+            index=models.Index(fields=['customer', 'order_date', 'id'], name='orders_customer_date_idx'),
+        ),
+    ]
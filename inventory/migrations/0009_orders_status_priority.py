@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:07
+
+from django.db import migrations, models
+
+
+def populate_status_priority(apps, schema_editor):
+    Orders = apps.get_model('inventory', 'Orders')
+    for order_status, priority in (('P', 1), ('A', 2), ('D', 3), ('C', 4)):
+        Orders.objects.filter(order_status=order_status).update(status_priority=priority)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0008_orders_orders_customer_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orders',
+            name='status_priority',
+            field=models.PositiveSmallIntegerField(default=1, editable=False),
+        ),
+        migrations.RunPython(populate_status_priority, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='orders',
+            index=models.Index(fields=['status_priority', 'order_date', 'id'], name='orders_queue_idx'),
+        ),
+    ]
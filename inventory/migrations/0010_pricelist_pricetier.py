@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0009_orders_status_priority'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceList',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('effective_from', models.DateField(unique=True)),
+                ('price_per_bottle', models.DecimalField(decimal_places=2, max_digits=5)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PriceTier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_quantity', models.PositiveIntegerField()),
+                ('price_per_bottle', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('price_list', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tiers', to='inventory.pricelist')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='pricetier',
+            constraint=models.UniqueConstraint(fields=('price_list', 'min_quantity'), name='pricetier_unique_quantity'),
+        ),
+    ]
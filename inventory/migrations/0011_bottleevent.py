@@ -0,0 +1,52 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:23
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def backfill_bottle_events(apps, schema_editor):
+    # Reconstruct what the existing bottle orders tell: when each bottle was issued and returned
+    BottleOrder = apps.get_model('inventory', 'BottleOrder')
+    BottleEvent = apps.get_model('inventory', 'BottleEvent')
+    rows = BottleOrder.objects.values_list('bottle_id', 'order_id', 'order__order_date', 'dateOfReturning')
+    events = []
+    for bottle_id, order_id, order_date, date_of_returning in rows.order_by('pk').iterator(chunk_size=2000):
+        events.append(BottleEvent(bottle_id=bottle_id, order_id=order_id, event='I', timestamp=order_date))
+        if date_of_returning:
+            returned_at = datetime.datetime.combine(date_of_returning, datetime.time.min)
+            if settings.USE_TZ:
+                returned_at = timezone.make_aware(returned_at)
+            events.append(BottleEvent(bottle_id=bottle_id, order_id=order_id, event='R', timestamp=returned_at))
+        if len(events) >= 2000:
+            BottleEvent.objects.bulk_create(events)
+            events = []
+    BottleEvent.objects.bulk_create(events)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_pricelist_pricetier'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BottleEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(choices=[('I', 'Issued'), ('D', 'Delivered'), ('R', 'Returned'), ('X', 'Discarded')], max_length=1)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('bottle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='inventory.bottle')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='inventory.orders')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bottle', 'timestamp', 'id'], name='bottleevent_bottle_time_idx'), models.Index(fields=['timestamp'], name='bottleevent_time_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_bottle_events, migrations.RunPython.noop),
+    ]
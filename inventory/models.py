@@ -1,11 +1,12 @@
-from base64 import b64encode
+from functools import partial
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from myapp.models import CustomUser, Address
+from django.utils import timezone
 from django.utils.translation import gettext_lazy
-import qrcode
-from io import BytesIO
+from inventory.pricing import get_order_price
+from inventory.qr import schedule_qr_code
 
 
 class OrderStatus(models.TextChoices):
@@ -15,40 +16,74 @@ class OrderStatus(models.TextChoices):
     CANCELLED = 'C', gettext_lazy('Cancelled')
 
 
+# Position of each status in the staff order queue, persisted on Orders.status_priority
+ORDER_STATUS_PRIORITY = {
+    OrderStatus.PENDING: 1,
+    OrderStatus.APPROVED: 2,
+    OrderStatus.DELIVERED: 3,
+    OrderStatus.CANCELLED: 4,
+}
+# Statuses the dispatchers still have to act on
+ACTIVE_ORDER_STATUSES = (OrderStatus.PENDING, OrderStatus.APPROVED)
+
+# The order state machine: the statuses each status may move to, delivered and cancelled are final
+ORDER_TRANSITIONS = {
+    OrderStatus.PENDING: (OrderStatus.APPROVED, OrderStatus.CANCELLED),
+    OrderStatus.APPROVED: (OrderStatus.DELIVERED, OrderStatus.CANCELLED),
+    OrderStatus.DELIVERED: (),
+    OrderStatus.CANCELLED: (),
+}
+# The same transitions keyed by target, the statuses an order may be in to reach it
+ORDER_TRANSITION_SOURCES = {
+    target: tuple(source for source, targets in ORDER_TRANSITIONS.items() if target in targets)
+    for target in OrderStatus
+}
+
+
 class BottleStatus(models.TextChoices):
     AVAILABLE = 'A', gettext_lazy('Available')
     SOLD = 'S', gettext_lazy('Sold')
     DISCARDED = 'D', gettext_lazy('Discarded')
 
 
+class QRCodeStatus(models.TextChoices):
+    PENDING = 'P', gettext_lazy('Pending')
+    READY = 'R', gettext_lazy('Ready')
+
+
+class BottleEventType(models.TextChoices):
+    ISSUED = 'I', gettext_lazy('Issued')
+    DELIVERED = 'D', gettext_lazy('Delivered')
+    RETURNED = 'R', gettext_lazy('Returned')
+    DISCARDED = 'X', gettext_lazy('Discarded')
+
+
 class Bottle(models.Model):
     bottleId = models.AutoField(primary_key=True)
     number_of_times_Sold = models.IntegerField(default=0)
     bottle_status = models.CharField(max_length=100, choices=BottleStatus.choices, default=BottleStatus.AVAILABLE)
+    # Legacy inline base64 rendering, QR codes are served from the image cache (see inventory.qr)
     qr_code = models.TextField(null=True, blank=True)
+    # Ready once the PNG QR code has been rendered into the image cache
+    qr_code_status = models.CharField(max_length=1, choices=QRCodeStatus.choices, default=QRCodeStatus.PENDING)
 
     def save(self, *args, **kwargs):
+        creating = self._state.adding
         super().save(*args, **kwargs)
-        if not self.qr_code:
-            self.qr_code = self.generate_qr_code(self.bottleId)
-            super().save()
-
-    def generate_qr_code(self, data):
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(str(data))
-        qr.make(fit=True)
-
-        img = qr.make_image(fill='black', back_color='white')
-        bio = BytesIO()
-        img.save(bio, format='PNG')
-        bio.seek(0)
-        image_data = b64encode(bio.read()).decode('utf-8')  # Convert bytes to base64 string
-        return image_data
+        if creating and not self.qr_code:
+            # Render the QR code into the image cache outside the request once the row is committed
+            transaction.on_commit(partial(schedule_qr_code, self.bottleId))
+
+
+class OrdersQuerySet(models.QuerySet):
+    def update_status(self, order_status):
+        # Bulk status changes must keep the persisted queue priority in sync
+        return self.update(order_status=order_status, status_priority=ORDER_STATUS_PRIORITY[order_status])
+
+    def transition(self, order_status):
+        # One conditional UPDATE that only moves the orders whose current status allows it, so
+        # concurrent dispatchers cannot both apply a transition; returns the number of orders moved
+        return self.filter(order_status__in=ORDER_TRANSITION_SOURCES[order_status]).update_status(order_status)
 
 
 class Orders(models.Model):
@@ -73,18 +108,27 @@ class Orders(models.Model):
     bottles = models.ManyToManyField(Bottle, through='BottleOrder')
     address = models.ForeignKey(Address, on_delete=models.CASCADE, related_name='Address')
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    status_priority = models.PositiveSmallIntegerField(default=1, editable=False)
 
-    def save(self, *args, **kwargs):
-        if not self.pk:  # Check if it's a new instance
-            # Default price if no special price is set
-            price_per_bottle = 20
+    objects = OrdersQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a customer's orders, newest first
+            models.Index(fields=['customer', 'order_date', 'id'], name='orders_customer_date_idx'),
+            # Staff order queue, sorted by status priority then oldest first
+            models.Index(fields=['status_priority', 'order_date', 'id'], name='orders_queue_idx'),
+        ]
 
-            # Check if customer has a special bottle price
-            if self.customer.specialBottlePrice > 0:
-                price_per_bottle = self.customer.specialBottlePrice
+    def save(self, *args, **kwargs):
+        self.status_priority = ORDER_STATUS_PRIORITY.get(self.order_status, 5)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'order_status' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'status_priority'}
 
-            # Calculate the total price
-            self.total_price = price_per_bottle * self.order_quantity
+        if not self.pk:  # Check if it's a new instance
+            # Calculate the total price, from the cached prices without loading the customer
+            self.total_price = get_order_price(self.customer_id, self.order_quantity)
 
         super(Orders, self).save(*args, **kwargs)  # Call the real save method
 
@@ -93,3 +137,45 @@ class BottleOrder(models.Model):
     bottle = models.ForeignKey(Bottle, on_delete=models.CASCADE)
     order = models.ForeignKey(Orders, on_delete=models.CASCADE)
     dateOfReturning = models.DateField(null=True)
+
+
+class BottleEvent(models.Model):
+    # Append-only history of a bottle, written in bulk by the add-bottles and return-bottles flows
+    bottle = models.ForeignKey(Bottle, on_delete=models.CASCADE, related_name='events')
+    event = models.CharField(max_length=1, choices=BottleEventType.choices)
+    order = models.ForeignKey(Orders, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # A bottle's history in one index range scan, oldest first
+            models.Index(fields=['bottle', 'timestamp', 'id'], name='bottleevent_bottle_time_idx'),
+            # Archiving of old events
+            models.Index(fields=['timestamp'], name='bottleevent_time_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Bottle events are append-only.')
+        super().save(*args, **kwargs)
+
+
+class PriceList(models.Model):
+    # Standard price per bottle from effective_from on, until the next list takes effect
+    effective_from = models.DateField(unique=True)
+    price_per_bottle = models.DecimalField(max_digits=5, decimal_places=2)
+
+    def __str__(self):
+        return f'{self.price_per_bottle} from {self.effective_from}'
+
+
+class PriceTier(models.Model):
+    # Volume discount: orders of at least min_quantity bottles pay price_per_bottle instead
+    price_list = models.ForeignKey(PriceList, on_delete=models.CASCADE, related_name='tiers')
+    min_quantity = models.PositiveIntegerField()
+    price_per_bottle = models.DecimalField(max_digits=5, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['price_list', 'min_quantity'], name='pricetier_unique_quantity'),
+        ]
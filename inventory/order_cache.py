@@ -0,0 +1,51 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+def get_cache():
+    return caches[getattr(settings, 'ORDERS_CACHE_ALIAS', 'default')]
+
+
+def _version_key(customer_id):
+    return f'orders:customer:{customer_id}:version'
+
+
+def get_customer_version(customer_id):
+    cache = get_cache()
+    version = cache.get(_version_key(customer_id))
+    if version is None:
+        # Start from the clock, so a version key that was evicted never resurrects older entries
+        cache.add(_version_key(customer_id), time.time_ns(), None)
+        version = cache.get(_version_key(customer_id))
+    return version
+
+
+def customer_orders_key(customer_id, url):
+    """
+    Cache key of one customer order list response. Every key embeds the customer's version,
+    so bumping the version invalidates all pages and query parameters at once.
+    """
+    url_hash = hashlib.sha1(url.encode()).hexdigest()
+    return f'orders:customer:{customer_id}:v{get_customer_version(customer_id)}:{url_hash}'
+
+
+def _bump_versions(customer_ids):
+    cache = get_cache()
+    for customer_id in customer_ids:
+        try:
+            cache.incr(_version_key(customer_id))
+        except ValueError:
+            cache.add(_version_key(customer_id), time.time_ns(), None)
+
+
+def invalidate_customer_orders(customer_ids):
+    """
+    Drop the cached order lists of these customers once the current transaction commits.
+    """
+    customer_ids = {customer_id for customer_id in customer_ids if customer_id}
+    if customer_ids:
+        transaction.on_commit(lambda: _bump_versions(customer_ids))
@@ -0,0 +1,104 @@
+"""
+Price per bottle resolution.
+
+A customer's special price, when set, overrides everything else. Otherwise the price list in
+effect on the order date applies, at the price of the largest volume tier the order quantity
+reaches, or at the list's base price. Without any price list the price is DEFAULT_PRICE_PER_BOTTLE.
+
+The price lists and the customers' special prices are cached in-process so pricing an order
+costs no query. Saving a customer or a price list drops its entry in this process once the
+transaction commits; other worker processes pick the change up after PRICING_CACHE_TTL seconds.
+"""
+import threading
+import time
+from bisect import bisect_right
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils import timezone
+
+from myapp.models import CustomUser
+
+DEFAULT_PRICE_PER_BOTTLE = Decimal(20)
+
+_lock = threading.Lock()
+# (loaded at, [effective from], [(base price, [(min quantity, price)] by quantity)]), both by date
+_price_lists = None
+# Customer id -> (loaded at, special price or None)
+_special_prices = {}
+
+
+def _fresh(loaded_at):
+    return time.monotonic() - loaded_at < getattr(settings, 'PRICING_CACHE_TTL', 60)
+
+
+def get_price_lists():
+    global _price_lists
+    cached = _price_lists
+    if cached is not None and _fresh(cached[0]):
+        return cached[1:]
+
+    from inventory.models import PriceList
+    dates, price_lists = [], []
+    for price_list in PriceList.objects.prefetch_related('tiers').order_by('effective_from'):
+        dates.append(price_list.effective_from)
+        price_lists.append((price_list.price_per_bottle,
+                            sorted((tier.min_quantity, tier.price_per_bottle) for tier in price_list.tiers.all())))
+    with _lock:
+        _price_lists = (time.monotonic(), dates, price_lists)
+    return dates, price_lists
+
+
+def get_special_price(customer_id):
+    cached = _special_prices.get(customer_id)
+    if cached is None or not _fresh(cached[0]):
+        prime_customers(CustomUser.objects.filter(pk=customer_id).only('specialBottlePrice'))
+        cached = _special_prices.get(customer_id, (None, None))
+    return cached[1]
+
+
+def prime_customers(customers):
+    # Cache the special prices of customers the caller has already loaded
+    now = time.monotonic()
+    with _lock:
+        for customer in customers:
+            _special_prices[customer.pk] = (now, customer.specialBottlePrice)
+
+
+def get_price_per_bottle(customer_id, quantity=1, on=None):
+    special_price = get_special_price(customer_id)
+    if special_price and special_price > 0:
+        return special_price
+
+    dates, price_lists = get_price_lists()
+    index = bisect_right(dates, on or timezone.localdate())
+    if not index:
+        return DEFAULT_PRICE_PER_BOTTLE
+    price, tiers = price_lists[index - 1]
+    for min_quantity, tier_price in tiers:
+        if quantity >= min_quantity:
+            price = tier_price
+    return price
+
+
+def get_order_price(customer_id, quantity, on=None):
+    return get_price_per_bottle(customer_id, quantity, on) * quantity
+
+
+def invalidate_customer(customer_id):
+    with _lock:
+        _special_prices.pop(customer_id, None)
+
+
+def invalidate_price_lists():
+    global _price_lists
+    with _lock:
+        _price_lists = None
+
+
+def reset():
+    # Forget every cached price, e.g. after test data has been rolled back
+    global _price_lists
+    with _lock:
+        _price_lists = None
+        _special_prices.clear()
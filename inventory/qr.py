@@ -0,0 +1,221 @@
+import hashlib
+import os
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+import qrcode
+import qrcode.image.svg
+from django.conf import settings
+from django.db import connection
+
+_lock = threading.Lock()
+_process_pool = None
+_writer_pool = None
+# Bottle ids whose QR code is currently being rendered, so a bottle is never rendered twice at once
+_pending = {}
+
+
+# Content types of the image formats a QR code can be rendered to
+QR_CODE_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+# Bump when the rendering parameters change, so cached images and their ETags are invalidated
+QR_CODE_RENDER_VERSION = 1
+
+
+def render_qr_image(data, image_format='png'):
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(str(data))
+    qr.make(fit=True)
+
+    bio = BytesIO()
+    if image_format == 'svg':
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(bio)
+    else:
+        qr.make_image(fill='black', back_color='white').save(bio, format='PNG')
+    return bio.getvalue()
+
+
+def qr_code_key(data, image_format):
+    return hashlib.sha256(f'{QR_CODE_RENDER_VERSION}:{image_format}:{data}'.encode()).hexdigest()
+
+
+def get_qr_code_path(data, image_format):
+    key = qr_code_key(data, image_format)
+    return Path(settings.QR_CODE_CACHE_DIR) / key[:2] / f'{key}.{image_format}'
+
+
+def store_qr_code_file(data, image_format, image):
+    """
+    Write a rendered image to the cache. Images are stored under their content key, so a file
+    never has to be invalidated.
+    """
+    path = get_qr_code_path(data, image_format)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first so concurrent readers never see a partial image
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent)
+    with os.fdopen(fd, 'wb') as tmp:
+        tmp.write(image)
+    os.replace(tmp_path, path)
+    return path
+
+
+def get_qr_code_file(data, image_format):
+    """
+    Return the path of the cached image for a QR code payload, rendering it on a cache miss.
+    """
+    path = get_qr_code_path(data, image_format)
+    if not path.exists():
+        store_qr_code_file(data, image_format, render_qr_image(data, image_format))
+    return path
+
+
+def _get_pools():
+    global _process_pool, _writer_pool
+    if _process_pool is None:
+        with _lock:
+            # Checked again under the lock, so concurrent first calls do not each start pools
+            if _process_pool is None:
+                workers = getattr(settings, 'QR_CODE_WORKERS', None)
+                # PIL work runs in separate processes, the threads only wait for it and write the result
+                _writer_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='qr-code')
+                _process_pool = ProcessPoolExecutor(max_workers=workers)
+    return _process_pool, _writer_pool
+
+
+def mark_qr_codes_ready(bottle_ids):
+    from inventory.models import Bottle, QRCodeStatus
+
+    Bottle.objects.filter(pk__in=bottle_ids, qr_code_status=QRCodeStatus.PENDING).update(
+        qr_code_status=QRCodeStatus.READY
+    )
+
+
+def _render_and_store(bottle_id):
+    try:
+        process_pool, _ = _get_pools()
+        store_qr_code_file(bottle_id, 'png', process_pool.submit(render_qr_image, str(bottle_id)).result())
+        mark_qr_codes_ready([bottle_id])
+    finally:
+        with _lock:
+            _pending.pop(bottle_id, None)
+        connection.close()
+
+
+def schedule_qr_code(bottle_id):
+    """
+    Render the PNG QR code of a bottle into the image cache in the background, and mark the
+    bottle ready once it is stored.
+    """
+    if not getattr(settings, 'QR_CODE_ASYNC', True):
+        store_qr_code_file(bottle_id, 'png', render_qr_image(str(bottle_id)))
+        mark_qr_codes_ready([bottle_id])
+        return None
+
+    _, writer_pool = _get_pools()
+    with _lock:
+        if bottle_id in _pending:
+            return _pending[bottle_id]
+        future = writer_pool.submit(_render_and_store, bottle_id)
+        _pending[bottle_id] = future
+    return future
+
+
+def render_qr_codes(bottle_ids, batch_size=None):
+    """
+    Render the PNG QR codes of many bottles across the process pool into the image cache, and
+    mark them ready with one update per chunk. Yields (bottle_id, image) pairs in the order of
+    bottle_ids.
+    """
+    batch_size = batch_size or getattr(settings, 'QR_CODE_BATCH_SIZE', 200)
+    payloads = [str(bottle_id) for bottle_id in bottle_ids]
+    if getattr(settings, 'QR_CODE_ASYNC', True):
+        process_pool, _ = _get_pools()
+        rendered = process_pool.map(render_qr_image, payloads, chunksize=max(1, batch_size // 4))
+    else:
+        rendered = map(render_qr_image, payloads)
+
+    chunk = []
+    try:
+        for bottle_id, image in zip(bottle_ids, rendered):
+            store_qr_code_file(bottle_id, 'png', image)
+            chunk.append(bottle_id)
+            if len(chunk) >= batch_size:
+                mark_qr_codes_ready(chunk)
+                chunk = []
+            yield bottle_id, image
+    finally:
+        # Also when the caller stops early, the images yielded so far are stored
+        if chunk:
+            mark_qr_codes_ready(chunk)
+
+
+def _render_many_and_store(bottle_ids):
+    try:
+        for _ in render_qr_codes(bottle_ids):
+            pass
+    finally:
+        connection.close()
+
+
+def schedule_qr_codes(bottle_ids):
+    """
+    Render the QR codes of a batch of new bottles in the background.
+    """
+    if not getattr(settings, 'QR_CODE_ASYNC', True):
+        _render_many_and_store(bottle_ids)
+        return None
+
+    _, writer_pool = _get_pools()
+    return writer_pool.submit(_render_many_and_store, list(bottle_ids))
+
+
+class _StreamBuffer:
+    # Write-only file object that hands whatever was written so far to the streaming response
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_qr_labels(bottle_ids):
+    """
+    Stream a ZIP archive with one printable PNG label per bottle, rendering the labels as the
+    archive is written instead of building it in memory.
+    """
+    buffer = _StreamBuffer()
+    rendered = render_qr_codes(bottle_ids)
+    streamed = 0
+    try:
+        with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED) as archive:
+            for bottle_id, image in rendered:
+                with archive.open(f'bottle-{bottle_id}.png', mode='w') as label:
+                    label.write(image)
+                streamed += 1
+                yield buffer.pop()
+        yield buffer.pop()
+    finally:
+        rendered.close()
+        if streamed < len(bottle_ids):
+            # The client went away before the end of the archive, render the remaining bottles anyway
+            schedule_qr_codes(bottle_ids[streamed:])
@@ -1,13 +1,19 @@
+import csv
 import datetime
+import json
 
-from django.core.exceptions import ObjectDoesNotExist
 from django.db import transaction
-from django.db.models import Max
+from django.db.models import Case, F, Max, Value, When
+from django.urls import reverse
+from django.utils import timezone
 
-from myapp.models import CustomUser as User, Payment
+from dashboard.kpis import invalidate_kpis_on_commit
+from myapp.models import Address, CustomUser as User, Payment, UserTypes
 from rest_framework import serializers
-from inventory import models
-from inventory.models import Bottle, Orders, BottleOrder, BottleStatus, OrderStatus
+from inventory import models, pricing
+from inventory.models import (Bottle, BottleEvent, BottleEventType, Orders, BottleOrder, BottleStatus, OrderStatus,
+                              ORDER_STATUS_PRIORITY, ORDER_TRANSITIONS, ORDER_TRANSITION_SOURCES)
+from inventory.order_cache import invalidate_customer_orders
 
 
 class OrdersSerializer(serializers.ModelSerializer):
@@ -17,28 +23,20 @@ class OrdersSerializer(serializers.ModelSerializer):
     customer_name = serializers.SerializerMethodField()
     customer_phoneNamber = serializers.SerializerMethodField()
 
+    # Relations and columns read while serializing, the views load them up front to avoid N+1 queries
+    select_related_fields = ('customer', 'address')
+    only_fields = ('id', 'order_date', 'order_quantity', 'order_status', 'status_priority', 'order_notes', 'receiver',
+                   'total_price', 'customer__id', 'customer__username', 'customer__phone_number', 'address__id', 'address__title')
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        return queryset.select_related(*cls.select_related_fields).only(*cls.only_fields)
+
     def validate(self, attrs):
-        print(attrs)
         super().validate(attrs)
+        # The PrimaryKeyRelatedField has already loaded the user, no need to fetch it again
         customer = attrs.get('customer')
-
-        # Check if 'customer' is already a user instance, and extract ID if so
-        if isinstance(customer, User):
-            customer_id = customer.id
-        else:
-            try:
-                # Assuming customer is the ID directly, or convert from string
-                customer_id = int(customer)
-            except (ValueError, TypeError):
-                raise serializers.ValidationError({"customer": "Invalid customer identifier."})
-
-        # Retrieve the user by ID and check type
-        try:
-            user = User.objects.get(id=customer_id)
-        except User.DoesNotExist:
-            raise serializers.ValidationError({"customer": "No such user exists."})
-
-        if user.type != 'C':
+        if customer is not None and customer.type != UserTypes.CUSTOMER:
             raise serializers.ValidationError({"customer": "User must be of type Customer"})
 
         return attrs
@@ -75,7 +73,104 @@ class OrdersSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class ChangeOrderStatusSerializer(serializers.Serializer):
+class OrderImportSerializer(serializers.Serializer):
+    MAX_ROWS = 10000
+    BATCH_SIZE = 500
+
+    file = serializers.FileField()
+
+    def parse_rows(self, upload):
+        lines = (line.decode('utf-8-sig') for line in upload)
+        if upload.name.lower().endswith(('.ndjson', '.jsonl')):
+            for line in lines:
+                if line.strip():
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        row = None
+                    yield row if isinstance(row, dict) else None
+        else:
+            yield from csv.DictReader(lines)
+
+    def validate(self, data):
+        rows = []
+        try:
+            for row in self.parse_rows(data['file']):
+                rows.append(row)
+                if len(rows) > self.MAX_ROWS:
+                    raise serializers.ValidationError(
+                        {"file": f"At most {self.MAX_ROWS} orders can be imported at once."}
+                    )
+        except UnicodeDecodeError:
+            raise serializers.ValidationError({"file": "The file must be UTF-8 encoded."})
+        except csv.Error as e:
+            raise serializers.ValidationError({"file": f"The file is not a valid CSV file: {e}"})
+
+        # Load every referenced customer and address once instead of once per row
+        customer_ids, address_ids = set(), set()
+        for row in rows:
+            if row:
+                customer_ids.add(str(row.get('customer')))
+                address_ids.add(str(row.get('address')))
+        customer_ids = [int(pk) for pk in customer_ids if pk.isdigit()]
+        address_ids = [int(pk) for pk in address_ids if pk.isdigit()]
+        customers = User.objects.only('id', 'type', 'specialBottlePrice').in_bulk(customer_ids)
+        pricing.prime_customers(customers.values())  # Price the rows from the customers just loaded
+        address_owners = dict(Address.objects.filter(pk__in=address_ids).values_list('id', 'user_id'))
+
+        # Row number -> {field: error}, the per-row report returned when the file is rejected
+        orders, errors = [], {}
+        for number, row in enumerate(rows, start=1):
+            if row is None:
+                errors[number] = {'row': 'Invalid row.'}
+                continue
+            row_errors = {}
+            customer = customers.get(int(row['customer'])) if str(row.get('customer')).isdigit() else None
+            if customer is None:
+                row_errors['customer'] = 'No such user exists.'
+            elif customer.type != UserTypes.CUSTOMER:
+                row_errors['customer'] = 'User must be of type Customer'
+            address_id = int(row['address']) if str(row.get('address')).isdigit() else None
+            if address_id not in address_owners:
+                row_errors['address'] = 'No such address exists.'
+            elif customer is not None and address_owners[address_id] != customer.pk:
+                row_errors['address'] = 'Address does not belong to the customer.'
+            quantity = str(row.get('order_quantity'))
+            if not quantity.isdigit() or int(quantity) < 1:
+                row_errors['order_quantity'] = 'A positive number is required.'
+
+            if row_errors:
+                errors[number] = row_errors
+            elif not errors:
+                order_quantity = int(quantity)
+                orders.append(Orders(
+                    customer=customer,
+                    address_id=address_id,
+                    order_quantity=order_quantity,
+                    order_notes=row.get('order_notes') or None,
+                    order_status=OrderStatus.APPROVED,
+                    status_priority=ORDER_STATUS_PRIORITY[OrderStatus.APPROVED],
+                    total_price=pricing.get_order_price(customer.pk, order_quantity),
+                ))
+
+        if errors:
+            # Nothing is imported unless every row is valid, so a corrected file can simply be uploaded again
+            raise serializers.ValidationError({'rows': errors})
+        if not orders:
+            raise serializers.ValidationError({"file": "The file does not contain any order."})
+        data['orders'] = orders
+        return data
+
+    def create(self, validated_data):
+        orders = validated_data['orders']
+        with transaction.atomic():
+            created = Orders.objects.bulk_create(orders, batch_size=self.BATCH_SIZE)
+            invalidate_customer_orders({order.customer_id for order in orders})
+            invalidate_kpis_on_commit()
+        return created
+
+
+class OrderStatusChangeSerializer(serializers.Serializer):
     order_id = serializers.IntegerField()
     new_order_status = serializers.CharField()
 
@@ -86,42 +181,57 @@ class ChangeOrderStatusSerializer(serializers.Serializer):
             raise serializers.ValidationError(f"{value} is not a valid choice for new_order_status.")
         return value
 
+
+class ChangeOrderStatusSerializer(OrderStatusChangeSerializer):
     def validate(self, data):
         order_id = data.get('order_id')
-        try:
-            order = Orders.objects.get(pk=order_id)
-        except Orders.DoesNotExist:
+        # Read what the error messages, the cache invalidation and the payment need
+        order = Orders.objects.only('order_status', 'total_price', 'customer_id').filter(pk=order_id).first()
+        if order is None:
             raise serializers.ValidationError("Order does not exist.")
+        if data['new_order_status'] not in ORDER_TRANSITIONS[order.order_status]:
+            raise serializers.ValidationError(
+                f"Order {order_id} cannot change from {order.get_order_status_display()} "
+                f"to {OrderStatus(data['new_order_status']).label}."
+            )
         data['order'] = order
         return data
 
     def update_order_status(self, validated_data):
-        order_id = validated_data.get('order_id')
+        order = validated_data['order']
         new_order_status = validated_data.get('new_order_status')
 
-        order = models.Orders.objects.get(pk=order_id)
-        order.order_status = new_order_status
-        order.save()
-        if new_order_status == OrderStatus.DELIVERED:
-            self.create_payment_record(order)
+        with transaction.atomic():
+            # The UPDATE re-checks the status, so a change since validate() is not overwritten
+            if not Orders.objects.filter(pk=order.pk).transition(new_order_status):
+                raise serializers.ValidationError(
+                    {'non_field_errors': [f"Order {order.pk} was changed meanwhile, please retry."]}
+                )
+            order.order_status = new_order_status
+            invalidate_customer_orders([order.customer_id])
+            invalidate_kpis_on_commit()
+
+            # Committed together with the status, a failed payment rolls the delivery back
+            if new_order_status == OrderStatus.DELIVERED:
+                self.create_payment_record(order)
 
         return order
 
+    @staticmethod
+    def get_payment_amount(order):
+        # Charge the price the order was placed at, later price changes do not apply to it
+        return order.total_price
+
     def create_payment_record(self, order):
-        if not order.customer:
+        if not order.customer_id:
             # Log an error or handle the case where the customer does not exist
             raise serializers.ValidationError("The order's customer does not exist.")
         else:
-            # Assuming you have a method or a property `get_special_price` in your customer model
-            special_price = order.customer.get_special_price() if hasattr(order.customer, 'get_special_price') else 20
-
-            amount = order.order_quantity * special_price
-
             # Create the payment record, assuming all foreign keys are valid
             try:
                 Payment.objects.create(
-                    amount=-amount,
-                    customer=order.customer,
+                    amount=-self.get_payment_amount(order),
+                    customer_id=order.customer_id,
                     receiver=None  # Assuming receiver can be None
                 )
             except Exception as e:
@@ -129,25 +239,144 @@ class ChangeOrderStatusSerializer(serializers.Serializer):
                 raise serializers.ValidationError(f"Failed to create payment record: {str(e)}")
 
 
+class BulkChangeOrderStatusSerializer(serializers.Serializer):
+    # The orders are read and checked together by update_order_statuses
+    changes = OrderStatusChangeSerializer(many=True, allow_empty=False)
+
+    MAX_CHANGES = 500
+
+    def validate_changes(self, value):
+        if len(value) > self.MAX_CHANGES:
+            raise serializers.ValidationError(f"At most {self.MAX_CHANGES} orders can be changed at once.")
+        return value
+
+    def update_order_statuses(self, validated_data):
+        changes = validated_data['changes']
+        self.results = []
+
+        with transaction.atomic():
+            # Lock the orders so the statuses checked below still hold when the grouped UPDATEs run
+            orders = Orders.objects.select_for_update().only(
+                'order_status', 'total_price', 'customer_id'
+            ).in_bulk({change['order_id'] for change in changes})
+
+            targets = {}
+            seen = set()
+            for change in changes:
+                order_id, new_order_status = change['order_id'], change['new_order_status']
+                order = orders.get(order_id)
+                if order is None:
+                    result = 'does not exist'
+                elif order_id in seen:
+                    result = 'duplicate'
+                elif new_order_status not in ORDER_TRANSITIONS[order.order_status]:
+                    result = (f'cannot change from {order.get_order_status_display()} '
+                              f'to {OrderStatus(new_order_status).label}')
+                else:
+                    result = 'updated'
+                    targets.setdefault(new_order_status, []).append(order)
+                seen.add(order_id)
+                self.results.append({'order_id': order_id, 'status': result})
+
+            # One UPDATE per target status
+            for new_order_status, target_orders in targets.items():
+                Orders.objects.filter(pk__in=[order.pk for order in target_orders]).transition(new_order_status)
+
+            delivered = targets.get(OrderStatus.DELIVERED, [])
+            if delivered:
+                # Also updates the wallets and the payment rollups
+                Payment.objects.bulk_create([
+                    Payment(amount=-ChangeOrderStatusSerializer.get_payment_amount(order),
+                            customer_id=order.customer_id, receiver=None)
+                    for order in delivered
+                ])
+
+            invalidate_customer_orders({order.customer_id for orders in targets.values() for order in orders})
+            invalidate_kpis_on_commit()
+
+        return sum(len(target_orders) for target_orders in targets.values())
+
+
 class BottleSerializer(serializers.ModelSerializer):
     qr_code = serializers.SerializerMethodField()
     bottle_status = serializers.SerializerMethodField()
+    qr_code_status = serializers.SerializerMethodField()
 
     class Meta:
         model = Bottle
-        fields = ['bottleId', 'number_of_times_Sold', 'bottle_status', 'qr_code']
+        fields = ['bottleId', 'number_of_times_Sold', 'bottle_status', 'qr_code', 'qr_code_status']
 
     def get_bottle_status(self, obj):
         return obj.get_bottle_status_display()
 
+    def get_qr_code_status(self, obj):
+        return obj.get_qr_code_status_display()
+
     def get_qr_code(self, obj):
-        if obj.qr_code:
-            return obj.qr_code  # Since qr_code is already a data URL, just return it directly
-        else:
-            qr_code_data = obj.generate_qr_code(obj.bottleId)
-            obj.qr_code = qr_code_data  # Save the QR code data URL to the model
-            obj.save()
-            return qr_code_data
+        # Only link to the image, it is served (and cached by clients) by the QR code endpoint
+        url = reverse('bottle-qr-png', kwargs={'pk': obj.pk})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+
+class BottleEventSerializer(serializers.ModelSerializer):
+    event = serializers.SerializerMethodField()
+
+    class Meta:
+        model = BottleEvent
+        fields = ['id', 'event', 'order', 'timestamp']
+
+    def get_event(self, obj):
+        return obj.get_event_display()
+
+
+class BottleBatchSerializer(serializers.Serializer):
+    MAX_BATCH_SIZE = 5000
+
+    count = serializers.IntegerField(required=False, min_value=1, max_value=MAX_BATCH_SIZE)
+    bottle_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, max_length=MAX_BATCH_SIZE
+    )
+    format = serializers.ChoiceField(choices=['json', 'zip'], default='json')
+
+    def validate(self, data):
+        count = data.get('count')
+        bottle_ids = data.get('bottle_ids')
+        if (count is None) == (bottle_ids is None):
+            raise serializers.ValidationError("Provide either count or bottle_ids.")
+
+        if bottle_ids is not None:
+            if len(set(bottle_ids)) != len(bottle_ids):
+                raise serializers.ValidationError({"bottle_ids": "Bottle ids must be unique."})
+            existing = list(Bottle.objects.filter(pk__in=bottle_ids).values_list('pk', flat=True)[:10])
+            if existing:
+                raise serializers.ValidationError({"bottle_ids": f"Bottles {existing} already exist."})
+        return data
+
+    def create(self, validated_data):
+        bottle_ids = validated_data.get('bottle_ids')
+
+        with transaction.atomic():
+            invalidate_kpis_on_commit()
+            if bottle_ids is not None:
+                Bottle.objects.bulk_create([Bottle(bottleId=bottle_id) for bottle_id in bottle_ids])
+                return bottle_ids
+
+            count = validated_data['count']
+            last_id = Bottle.objects.aggregate(last_id=Max('bottleId'))['last_id'] or 0
+            bottles = Bottle.objects.bulk_create([Bottle() for _ in range(count)])
+            if all(bottle.bottleId for bottle in bottles):
+                return [bottle.bottleId for bottle in bottles]
+            # MySQL does not return the generated keys from a bulk insert, so read them back
+            return list(
+                Bottle.objects.filter(bottleId__gt=last_id).order_by('bottleId').values_list('bottleId', flat=True)[:count]
+            )
+
+
+class ExportFilterSerializer(serializers.Serializer):
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    customer = serializers.IntegerField(required=False, min_value=1)
 
 
 class BottleOrderSerializer(serializers.Serializer):
@@ -158,36 +387,76 @@ class BottleOrderSerializer(serializers.Serializer):
 
     def create(self, validated_data):
         order_id = validated_data.get('order_id')
-        bottle_ids = validated_data.get('bottle_ids')
-        order = Orders.objects.get(pk=order_id)
-
-        bottle_count = BottleOrder.objects.filter(order=order).count()
-        if bottle_count == order.order_quantity:
-            return {'status': f'cant add more bottles to this order'}
+        # Drop duplicated ids but keep the order the bottles were scanned in
+        bottle_ids = list(dict.fromkeys(validated_data.get('bottle_ids')))
+        self.bottle_results = []
 
         with transaction.atomic():
-
-            for bottle_id in bottle_ids:
-                try:
-                    bottle = Bottle.objects.select_for_update().get(pk=bottle_id)
-                    if bottle.bottle_status == BottleStatus.SOLD:
-                        # Bottle is already sold, return a message
-                        return {'status': f'bottle {bottle_id} is sold '}
-                    elif bottle.bottle_status == BottleStatus.DISCARDED:
-                        # Bottle is discarded, return a message
-                        return {'status': f'bottle {bottle_id} is discarded '}
-                    else:
-                        bottle.bottle_status = BottleStatus.SOLD
-                        bottle.save()
-                        BottleOrder.objects.create(order=order, bottle=bottle, dateOfReturning=None)
-                except ObjectDoesNotExist:
-                    # Bottle does not exist, return a message
-                    return {'status': f'bottle {bottle_id} does not exist'}
+            try:
+                order = Orders.objects.select_for_update().get(pk=order_id)
+            except Orders.DoesNotExist:
+                return {'status': f'order {order_id} does not exist', 'results': []}
 
             bottle_count = BottleOrder.objects.filter(order=order).count()
             if bottle_count == order.order_quantity:
+                return {'status': f'cant add more bottles to this order', 'results': []}
+            if bottle_count + len(bottle_ids) > order.order_quantity:
+                return {'status': f'order {order_id} only takes {order.order_quantity - bottle_count} more bottles',
+                        'results': []}
+            # The last bottle delivers the order, so only orders that may become delivered take bottles,
+            # besides the ones already delivered through change-status
+            already_delivered = order.order_status == OrderStatus.DELIVERED
+            if not already_delivered and order.order_status not in ORDER_TRANSITION_SOURCES[OrderStatus.DELIVERED]:
+                return {'status': f'cant add bottles to a {order.get_order_status_display().lower()} order',
+                        'results': []}
+
+            # Lock every requested bottle in one query and validate them in memory
+            bottles = Bottle.objects.select_for_update().filter(pk__in=bottle_ids).in_bulk()
+            error = None
+            for bottle_id in bottle_ids:
+                bottle = bottles.get(bottle_id)
+                if bottle is None:
+                    result = 'does not exist'
+                elif bottle.bottle_status == BottleStatus.SOLD:
+                    result = 'sold'
+                elif bottle.bottle_status == BottleStatus.DISCARDED:
+                    result = 'discarded'
+                else:
+                    result = 'assigned'
+                if result != 'assigned' and error is None:
+                    error = f'bottle {bottle_id} does not exist' if bottle is None else f'bottle {bottle_id} is {result} '
+                self.bottle_results.append({'bottle_id': bottle_id, 'status': result})
+
+            if error:
+                # Nothing has been written yet, so the whole batch is rejected as is
+                return {'status': error, 'results': self.bottle_results}
+
+            Bottle.objects.filter(pk__in=bottle_ids).update(bottle_status=BottleStatus.SOLD)
+            BottleOrder.objects.bulk_create(
+                [BottleOrder(order=order, bottle_id=bottle_id, dateOfReturning=None) for bottle_id in bottle_ids]
+            )
+            invalidate_customer_orders([order.customer_id])
+            invalidate_kpis_on_commit()
+            User.add_outstanding_bottles({order.customer_id: len(bottle_ids)})
+
+            now = timezone.now()
+            events = [BottleEvent(bottle_id=bottle_id, order=order, event=BottleEventType.ISSUED, timestamp=now)
+                      for bottle_id in bottle_ids]
+            if already_delivered:
+                # Delivered and charged already, the bottles are delivered as they are recorded
+                events += [BottleEvent(bottle_id=bottle_id, order=order, event=BottleEventType.DELIVERED, timestamp=now)
+                           for bottle_id in bottle_ids]
+            elif bottle_count + len(bottle_ids) == order.order_quantity:
+                # The order row is locked and its status checked above, so the transition applies
+                Orders.objects.filter(pk=order.pk).transition(OrderStatus.DELIVERED)
                 order.order_status = OrderStatus.DELIVERED
-                order.save()
+                ChangeOrderStatusSerializer().create_payment_record(order)
+                # Every bottle of the order, including the ones added by earlier requests, is delivered now
+                order_bottle_ids = bottle_ids if not bottle_count else \
+                    BottleOrder.objects.filter(order=order).values_list('bottle_id', flat=True)
+                events += [BottleEvent(bottle_id=bottle_id, order=order, event=BottleEventType.DELIVERED, timestamp=now)
+                           for bottle_id in order_bottle_ids]
+            BottleEvent.objects.bulk_create(events)
 
             return order
 
@@ -195,45 +464,71 @@ class BottleOrderSerializer(serializers.Serializer):
 class ReturnBottlesSerializer(serializers.Serializer):
     bottle_ids = serializers.ListField(child=serializers.IntegerField())
 
+    # A bottle is discarded once it has been sold this many times
+    DISCARD_THRESHOLD = 35
+
     def validate(self, data):
-        bottle_ids = data['bottle_ids']
-        bottles_with_orders = BottleOrder.objects.filter(
+        bottle_ids = set(data['bottle_ids'])
+        # Resolve the open (not yet returned) BottleOrder rows once and hand them to update()
+        open_bottle_orders = BottleOrder.objects.filter(
             bottle_id__in=bottle_ids,
             dateOfReturning__isnull=True  # Filter for orders that have not been returned
-        ).annotate(
-            latest_order_id=Max('order__id')
-        )
-
-        bottle_ids_with_valid_orders = {bo.bottle_id for bo in bottles_with_orders}
-        if len(bottle_ids_with_valid_orders) != len(bottle_ids):
+        ).values_list('id', 'bottle_id', 'order_id', 'order__customer_id')
+
+        bottle_order_ids = []
+        bottle_ids_with_valid_orders = set()
+        returned_per_customer = {}
+        bottle_orders = {}
+        for bottle_order_id, bottle_id, order_id, customer_id in open_bottle_orders:
+            bottle_order_ids.append(bottle_order_id)
+            bottle_ids_with_valid_orders.add(bottle_id)
+            returned_per_customer[customer_id] = returned_per_customer.get(customer_id, 0) + 1
+            bottle_orders[bottle_id] = order_id
+
+        if bottle_ids_with_valid_orders != bottle_ids:
             raise serializers.ValidationError("One or more bottles do not have unreturned orders or are invalid.")
 
+        data['bottle_order_ids'] = bottle_order_ids
+        data['returned_per_customer'] = returned_per_customer
+        data['bottle_orders'] = bottle_orders
         return data
 
     def update(self, instance, validated_data):
-        bottle_ids = validated_data.get('bottle_ids')
-        # Process the return based on the last order associated without a return date
-        bottles_with_orders = BottleOrder.objects.filter(
-            bottle_id__in=bottle_ids,
-            dateOfReturning__isnull=True
-        ).annotate(
-            latest_order_id=Max('order__id')
-        )
+        bottle_ids = set(validated_data.get('bottle_ids'))
+        bottle_order_ids = validated_data.get('bottle_order_ids')
 
         with transaction.atomic():
-            for bottle_order in bottles_with_orders:
-                bottle = bottle_order.bottle
-                order = Orders.objects.get(id=bottle_order.latest_order_id)
-
-                bottle.number_of_times_Sold += 1
-                if bottle.number_of_times_Sold >= 35:
-                    bottle.bottle_status = BottleStatus.DISCARDED
-                else:
-                    bottle.bottle_status = BottleStatus.AVAILABLE
-                bottle.save()
-
-                # Update the BottleOrder instance to mark it as returned
-                bottle_order.dateOfReturning = datetime.date.today()
-                bottle_order.save()
+            # Mark the BottleOrder rows as returned. The rows are re-checked (and locked) by the UPDATE,
+            # so when a concurrent request returned some of them first nothing is counted twice
+            returned = BottleOrder.objects.filter(pk__in=bottle_order_ids, dateOfReturning__isnull=True).update(
+                dateOfReturning=datetime.date.today()
+            )
+            if returned != len(bottle_order_ids):
+                raise serializers.ValidationError("One or more bottles have just been returned.")
+            returned_per_customer = validated_data.get('returned_per_customer')
+            invalidate_customer_orders(list(returned_per_customer))
+            invalidate_kpis_on_commit()
+            User.add_outstanding_bottles({customer_id: -count for customer_id, count in returned_per_customer.items()})
+
+            # Increment the sold counter in the database and discard the bottles that reach the
+            # threshold. The status is assigned first: MySQL applies the SET assignments left to right,
+            # so this way the Case reads the counter before the increment on every database
+            Bottle.objects.filter(pk__in=bottle_ids).update(
+                bottle_status=Case(
+                    When(number_of_times_Sold__gte=self.DISCARD_THRESHOLD - 1, then=Value(BottleStatus.DISCARDED)),
+                    default=Value(BottleStatus.AVAILABLE),
+                ),
+                number_of_times_Sold=F('number_of_times_Sold') + 1,
+            )
+
+            now = timezone.now()
+            bottle_orders = validated_data.get('bottle_orders')
+            events = [BottleEvent(bottle_id=bottle_id, order_id=bottle_orders.get(bottle_id),
+                                  event=BottleEventType.RETURNED, timestamp=now) for bottle_id in bottle_ids]
+            discarded = Bottle.objects.filter(pk__in=bottle_ids, bottle_status=BottleStatus.DISCARDED)
+            events += [BottleEvent(bottle_id=bottle_id, order_id=bottle_orders.get(bottle_id),
+                                   event=BottleEventType.DISCARDED, timestamp=now)
+                       for bottle_id in discarded.values_list('pk', flat=True)]
+            BottleEvent.objects.bulk_create(events)
 
         return instance
@@ -0,0 +1,35 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from inventory import pricing
+from inventory.models import BottleOrder, Orders, PriceList, PriceTier
+from inventory.order_cache import invalidate_customer_orders
+from myapp.models import CustomUser, Payment
+
+
+@receiver([post_save, post_delete], sender=Orders)
+@receiver([post_save, post_delete], sender=Payment)
+def invalidate_orders_of_customer(sender, instance, **kwargs):
+    invalidate_customer_orders([instance.customer_id])
+
+
+@receiver([post_save, post_delete], sender=BottleOrder)
+def invalidate_orders_of_bottle_order(sender, instance, **kwargs):
+    invalidate_customer_orders(Orders.objects.filter(pk=instance.order_id).values_list('customer_id', flat=True))
+
+
+# The prices are dropped once the change commits: dropped earlier, a read in the same transaction
+# would cache the uncommitted price, and keep serving it after a rollback
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_customer_price(sender, instance, **kwargs):
+    transaction.on_commit(partial(pricing.invalidate_customer, instance.pk))
+
+
+@receiver([post_save, post_delete], sender=PriceList)
+@receiver([post_save, post_delete], sender=PriceTier)
+def invalidate_price_lists(sender, **kwargs):
+    transaction.on_commit(pricing.invalidate_price_lists)
@@ -1,3 +1,667 @@
-from django.test import TestCase
+import csv
+import datetime
+import json
+import tempfile
+import zipfile
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from inventory import pricing
+from inventory.benchmark import BenchmarkRunner
+from inventory.models import (Bottle, BottleEvent, BottleEventType, BottleStatus, OrderStatus, Orders, PriceList,
+                              QRCodeStatus)
+from inventory.order_cache import get_cache
+from inventory.qr import get_qr_code_path
+from inventory.serializers import ChangeOrderStatusSerializer, ReturnBottlesSerializer
+from myapp.models import Address, CustomUser, Payment, UserTypes
+
+
+class OrdersTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'pass', type=UserTypes.Admin)
+        cls.customers = []
+        for index in range(3):
+            customer = CustomUser.objects.create_user(f'customer{index}', f'customer{index}@example.com', 'pass',
+                                                      type=UserTypes.CUSTOMER, specialBottlePrice=0)
+            Address.objects.create(title=f'address {index}', user=customer)
+            cls.customers.append(customer)
+
+    def setUp(self):
+        get_cache().clear()
+        # The in-process prices outlive the rolled back test data
+        self.addCleanup(pricing.reset)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create_orders(self, count, order_status=OrderStatus.PENDING):
+        # Run the on-commit cache invalidation the order writes schedule
+        with self.captureOnCommitCallbacks(execute=True):
+            for index in range(count):
+                customer = self.customers[index % len(self.customers)]
+                Orders.objects.create(order_quantity=2, customer=customer, address=customer.addresses.first(),
+                                      receiver=self.admin, order_status=order_status)
+
+
+class OrdersQueryCountTests(OrdersTestCase):
+    """
+    The order endpoints must run a fixed number of queries, however many orders they return.
+    """
+
+    def assertConstantQueries(self, url, num):
+        for count in (1, 10):
+            self.create_orders(count)
+            with self.assertNumQueries(num):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_orders_list(self):
+        self.assertConstantQueries('/orders/', 1)
+
+    def test_customer_orders_list(self):
+        self.assertConstantQueries(f'/orders/customer/{self.customers[0].pk}', 1)
+
+    def test_active_orders_list(self):
+        for order_status in (OrderStatus.DELIVERED, OrderStatus.APPROVED, OrderStatus.CANCELLED, OrderStatus.PENDING):
+            self.create_orders(2, order_status)
+        with self.assertNumQueries(1):
+            response = self.client.get('/orders/', {'active': '1'})
+        # The pending orders first, then the approved ones, each oldest first
+        expected = [order.pk for order_status in (OrderStatus.PENDING, OrderStatus.APPROVED)
+                    for order in Orders.objects.filter(order_status=order_status).order_by('order_date', 'pk')]
+        self.assertEqual([order['id'] for order in response.data['results']], expected)
+        self.assertEqual(len(self.client.get('/orders/').data['results']), 8)
+
+    def test_order_detail(self):
+        self.create_orders(1)
+        order = Orders.objects.get()
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/orders/{order.pk}')
+        self.assertEqual(response.data['customer_name'], order.customer.username)
+        self.assertEqual(response.data['order_address'], order.address.title)
+
+    def test_bottles_list(self):
+        for count in (1, 10):
+            Bottle.objects.bulk_create([Bottle() for _ in range(count)])
+            with self.assertNumQueries(1):
+                response = self.client.get('/bottles/')
+            self.assertEqual(response.status_code, 200)
+
+
+@override_settings(QR_CODE_ASYNC=False)
+class QRCodeTestCase(OrdersTestCase):
+    def setUp(self):
+        super().setUp()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache_dir_override = override_settings(QR_CODE_CACHE_DIR=cache_dir.name)
+        cache_dir_override.enable()
+        self.addCleanup(cache_dir_override.disable)
+
+    def assertQRCodesReady(self, bottle_ids):
+        self.assertEqual(set(Bottle.objects.filter(qr_code_status=QRCodeStatus.READY).values_list('pk', flat=True)),
+                         set(bottle_ids))
+        for bottle_id in bottle_ids:
+            self.assertTrue(get_qr_code_path(bottle_id, 'png').exists())
+
+
+class BottleQRCodeTests(QRCodeTestCase):
+    """
+    New bottles are rendered into the QR image cache, which the image endpoints serve.
+    """
+
+    def test_new_bottle_rendered_into_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            bottle = Bottle.objects.create()
+        bottle.refresh_from_db()
+        self.assertEqual(bottle.qr_code_status, QRCodeStatus.READY)
+        self.assertIsNone(bottle.qr_code)
+
+        response = self.client.get('/bottles/')
+        self.assertEqual(response.data['results'], [{
+            'bottleId': bottle.pk, 'number_of_times_Sold': 0, 'bottle_status': 'Available',
+            'qr_code': f'http://testserver/bottles/{bottle.pk}/qr.png', 'qr_code_status': 'Ready',
+        }])
+
+        response = self.client.get(f'/bottles/{bottle.pk}/qr.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(b''.join(response.streaming_content), get_qr_code_path(bottle.pk, 'png').read_bytes())
+
+    def test_svg(self):
+        bottle = Bottle.objects.create()
+        response = self.client.get(f'/bottles/{bottle.pk}/qr.svg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'<svg', b''.join(response.streaming_content))
+
+    def test_conditional_get(self):
+        bottle = Bottle.objects.create()
+        etag = self.client.get(f'/bottles/{bottle.pk}/qr.png')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/bottles/{bottle.pk}/qr.png', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_unknown_bottle(self):
+        response = self.client.get('/bottles/1/qr.png')
+        self.assertEqual(response.status_code, 404)
+
+
+class BottleBatchTests(QRCodeTestCase):
+    """
+    Bottles are provisioned in batches, with their QR codes rendered after commit or streamed as labels.
+    """
+
+    def create_batch(self, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/bottles/batch/', data, format='json')
+
+    def test_count(self):
+        response = self.create_batch({'count': 3})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['bottle_ids'], list(Bottle.objects.order_by('pk').values_list('pk', flat=True)))
+        self.assertQRCodesReady(response.data['bottle_ids'])
+
+    def test_bottle_ids(self):
+        response = self.create_batch({'bottle_ids': [7, 5]})
+        self.assertEqual(response.status_code, 201)
+        self.assertQRCodesReady([5, 7])
+
+        response = self.create_batch({'bottle_ids': [5, 6]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'bottle_ids': ['Bottles [5] already exist.']})
+        response = self.create_batch({'bottle_ids': [8, 8]})
+        self.assertEqual(response.status_code, 400)
+        response = self.create_batch({'count': 1, 'bottle_ids': [9]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Bottle.objects.count(), 2)
+
+    def test_zip(self):
+        response = self.create_batch({'bottle_ids': [1, 2, 3], 'format': 'zip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertEqual(archive.namelist(), ['bottle-1.png', 'bottle-2.png', 'bottle-3.png'])
+            self.assertEqual(archive.read('bottle-2.png'), get_qr_code_path(2, 'png').read_bytes())
+        self.assertQRCodesReady([1, 2, 3])
+
+    def test_zip_client_disconnect(self):
+        response = self.create_batch({'bottle_ids': [1, 2, 3], 'format': 'zip'})
+        next(iter(response.streaming_content))
+        response.close()
+        self.assertQRCodesReady([1, 2, 3])
+
+
+class CustomerOrdersCacheTests(OrdersTestCase):
+    """
+    Polling a customer's order list is served from the cache until one of their orders changes.
+    """
+
+    def test_repeated_poll_is_cached(self):
+        url = f'/orders/customer/{self.customers[0].pk}'
+        self.create_orders(1)
+        response = self.client.get(url)
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertEqual(cached.data, response.data)
+
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_new_order_invalidates_customer(self):
+        url = f'/orders/customer/{self.customers[0].pk}'
+        other_url = f'/orders/customer/{self.customers[1].pk}'
+        self.create_orders(2)
+        etag = self.client.get(url)['ETag']
+        other_etag = self.client.get(other_url)['ETag']
+
+        self.create_orders(1)  # Only for the first customer
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(other_url, HTTP_IF_NONE_MATCH=other_etag).status_code, 304)
+
+
+class OrderImportTests(OrdersTestCase):
+    """
+    Orders are imported from CSV or NDJSON files, all of them or none.
+    """
+
+    def upload(self, name, content):
+        return self.client.post('/orders/import/', {'file': SimpleUploadedFile(name, content)}, format='multipart')
+
+    def test_csv(self):
+        first, second = self.customers[:2]
+        content = (f'customer,address,order_quantity,order_notes\n'
+                   f'{first.pk},{first.addresses.get().pk},3,ring twice\n'
+                   f'{second.pk},{second.addresses.get().pk},1,\n')
+        response = self.upload('orders.csv', content.encode())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(list(Orders.objects.order_by('pk').values_list('customer', 'order_quantity', 'order_notes',
+                                                                        'order_status', 'total_price')),
+                         [(first.pk, 3, 'ring twice', OrderStatus.APPROVED, 60),
+                          (second.pk, 1, None, OrderStatus.APPROVED, 20)])
+
+    def test_row_errors(self):
+        first, second = self.customers[:2]
+        rows = [
+            {'customer': first.pk, 'address': first.addresses.get().pk, 'order_quantity': 2},
+            {'customer': first.pk, 'address': second.addresses.get().pk, 'order_quantity': 2},
+            {'customer': self.admin.pk, 'address': 0, 'order_quantity': 0},
+        ]
+        content = '\n'.join([json.dumps(row) for row in rows] + ['not json'])
+        response = self.upload('orders.ndjson', content.encode())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content), {'rows': {
+            '2': {'address': 'Address does not belong to the customer.'},
+            '3': {'customer': 'User must be of type Customer', 'address': 'No such address exists.',
+                  'order_quantity': 'A positive number is required.'},
+            '4': {'row': 'Invalid row.'},
+        }})
+        # The valid first row is not imported either
+        self.assertFalse(Orders.objects.exists())
+
+    def test_not_utf8(self):
+        response = self.upload('orders.csv', 'customer,address,order_quantity\nJosé,1,2\n'.encode('latin-1'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'file': ['The file must be UTF-8 encoded.']})
+
+
+class ExportTests(OrdersTestCase):
+    """
+    Tables are exported as streamed CSV or NDJSON, from the API or the export_data command.
+    """
+
+    def test_csv(self):
+        self.create_orders(3)
+        response = self.client.get('/exports/orders.csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="orders.csv"')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], ['id', 'order_date', 'order_status', 'order_quantity', 'total_price', 'customer_id',
+                                   'address_id', 'receiver_id', 'delivery_date'])
+        orders = Orders.objects.order_by('pk')
+        self.assertEqual([row[0] for row in rows[1:]], [str(order.pk) for order in orders])
+        self.assertEqual(rows[1][2:6], [OrderStatus.PENDING, '2', '40.00', str(orders[0].customer_id)])
+
+    def test_ndjson(self):
+        customer = self.customers[1]
+        payment = Payment.objects.create(amount=10, customer=customer, receiver=self.admin)
+        Payment.objects.create(amount=5, customer=self.customers[2])
+        response = self.client.get('/exports/payments.ndjson', {'customer': customer.pk})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{
+            'id': payment.pk, 'created_at': payment.created_at.isoformat(), 'amount': '10.00',
+            'customer_id': customer.pk, 'receiver_id': self.admin.pk,
+        }])
+
+    def test_filters(self):
+        self.create_orders(2)
+        tomorrow = timezone.localdate() + datetime.timedelta(days=1)
+        response = self.client.get('/exports/orders.csv', {'date_from': tomorrow.isoformat()})
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 1)
+        response = self.client.get('/exports/orders.csv', {'date_to': timezone.localdate().isoformat()})
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 3)
+
+        self.assertEqual(self.client.get('/exports/orders.csv', {'date_from': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get('/exports/orders.xml').status_code, 404)
+        self.assertEqual(self.client.get('/exports/users.csv').status_code, 404)
+
+    def test_command(self):
+        self.create_orders(2)
+        bottle = Bottle.objects.create()
+        order = Orders.objects.order_by('pk').first()
+        Orders.objects.filter(pk=order.pk).update_status(OrderStatus.APPROVED)
+        self.client.post('/bottles/add-bottles-to-order/', {'order_id': order.pk, 'bottle_ids': [bottle.pk]},
+                         format='json')
+
+        output = StringIO()
+        call_command('export_data', 'bottle-orders', file_format='ndjson', stdout=output)
+        rows = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([(row['order_id'], row['bottle_id'], row['dateOfReturning']) for row in rows],
+                         [(order.pk, bottle.pk, None)])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/orders.csv'
+            call_command('export_data', 'orders', customer_id=order.customer_id, output=path)
+            with open(path, newline='') as exported:
+                rows = list(csv.reader(exported))
+        self.assertEqual([row[0] for row in rows], ['id', str(order.pk)])
+
+
+class ChangeOrderStatusTests(OrdersTestCase):
+    """
+    Status changes follow ORDER_TRANSITIONS and are applied with a conditional UPDATE.
+    """
+
+    def change_status(self, order, new_order_status):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.patch('/orders/change-status/',
+                                     {'order_id': order.pk, 'new_order_status': new_order_status}, format='json')
+
+    def test_approve(self):
+        self.create_orders(1)
+        order = Orders.objects.get()
+        with self.assertNumQueries(4):  # The read and the UPDATE, inside the test's savepoint
+            response = self.change_status(order, 'approved')
+        self.assertEqual(response.status_code, 200)
+        order.refresh_from_db()
+        self.assertEqual((order.order_status, order.status_priority), (OrderStatus.APPROVED, 2))
+
+    def test_deliver_creates_payment(self):
+        self.create_orders(1)
+        order = Orders.objects.get()
+        Orders.objects.update_status(OrderStatus.APPROVED)
+        response = self.change_status(order, 'delivered')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Payment.objects.get().amount, -order.order_quantity * 20)
+
+    def test_payment_charges_order_price(self):
+        self.create_orders(1, OrderStatus.APPROVED)
+        order = Orders.objects.get()
+        # The customer's price changes between the order and its delivery
+        customer = order.customer
+        customer.specialBottlePrice = 15
+        customer.save()
+        response = self.change_status(order, 'delivered')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Payment.objects.get().amount, -order.total_price)
+        self.assertEqual(order.total_price, 40)
+
+    def test_disallowed_transition(self):
+        self.create_orders(1)
+        order = Orders.objects.get()
+        response = self.change_status(order, 'delivered')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'non_field_errors': [f'Order {order.pk} cannot change from Pending '
+                                                              f'to Delivered.']})
+        order.refresh_from_db()
+        self.assertEqual(order.order_status, OrderStatus.PENDING)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_unknown_order(self):
+        response = self.client.patch('/orders/change-status/', {'order_id': 0, 'new_order_status': 'approved'},
+                                     format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'non_field_errors': ['Order does not exist.']})
+
+    def test_changed_meanwhile(self):
+        self.create_orders(1)
+        order = Orders.objects.get()
+        serializer = ChangeOrderStatusSerializer(data={'order_id': order.pk, 'new_order_status': 'approved'})
+        self.assertTrue(serializer.is_valid())
+        Orders.objects.update_status(OrderStatus.CANCELLED)
+        with self.assertRaises(ValidationError) as raised:
+            serializer.update_order_status(serializer.validated_data)
+        self.assertEqual(raised.exception.detail,
+                         {'non_field_errors': [f'Order {order.pk} was changed meanwhile, please retry.']})
+
+
+class BulkChangeOrderStatusTests(OrdersTestCase):
+    def test_grouped_changes(self):
+        self.create_orders(4)
+        pending, approved, delivered, cancelled = Orders.objects.order_by('pk')
+        Orders.objects.filter(pk__in=[approved.pk, delivered.pk]).update_status(OrderStatus.APPROVED)
+        changes = [
+            {'order_id': pending.pk, 'new_order_status': 'approved'},
+            {'order_id': approved.pk, 'new_order_status': 'delivered'},
+            {'order_id': delivered.pk, 'new_order_status': 'delivered'},
+            {'order_id': cancelled.pk, 'new_order_status': 'delivered'},
+            {'order_id': pending.pk, 'new_order_status': 'cancelled'},
+            {'order_id': 0, 'new_order_status': 'approved'},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/orders/change-status/bulk/', {'changes': changes}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']],
+                         ['updated', 'updated', 'updated', 'cannot change from Pending to Delivered', 'duplicate',
+                          'does not exist'])
+        self.assertEqual(dict(Orders.objects.values_list('pk', 'order_status')), {
+            pending.pk: OrderStatus.APPROVED, approved.pk: OrderStatus.DELIVERED,
+            delivered.pk: OrderStatus.DELIVERED, cancelled.pk: OrderStatus.PENDING,
+        })
+        self.assertEqual(Payment.objects.count(), 2)
+        self.assertEqual(CustomUser.objects.get(pk=approved.customer_id).wallet_balance, -40)
+
+
+class PricingTests(OrdersTestCase):
+    """
+    Orders and delivery payments are priced from the cached special prices and price lists.
+    """
+
+    def test_price_lists_and_tiers(self):
+        customer = self.customers[0]
+        today = timezone.localdate()
+        with self.captureOnCommitCallbacks(execute=True):
+            PriceList.objects.create(effective_from=today - datetime.timedelta(days=30), price_per_bottle=18)
+            current = PriceList.objects.create(effective_from=today, price_per_bottle=22)
+            current.tiers.create(min_quantity=10, price_per_bottle=19)
+
+        self.assertEqual(pricing.get_price_per_bottle(customer.pk, 1, today - datetime.timedelta(days=1)), 18)
+        self.assertEqual(pricing.get_price_per_bottle(customer.pk, 9), 22)
+        with self.assertNumQueries(0):
+            self.assertEqual(pricing.get_price_per_bottle(customer.pk, 10), 19)
+        self.assertEqual(pricing.get_price_per_bottle(customer.pk, 1, today - datetime.timedelta(days=31)),
+                         pricing.DEFAULT_PRICE_PER_BOTTLE)
+
+    def test_special_price_invalidated_on_save(self):
+        customer = self.customers[0]
+        self.assertEqual(pricing.get_price_per_bottle(customer.pk), pricing.DEFAULT_PRICE_PER_BOTTLE)
+        customer.specialBottlePrice = 15
+        with self.captureOnCommitCallbacks(execute=True):
+            customer.save()
+        self.create_orders(1)
+        order = Orders.objects.get()
+        self.assertEqual(order.total_price, order.order_quantity * 15)
+
+        Orders.objects.update_status(OrderStatus.APPROVED)
+        self.client.patch('/orders/change-status/', {'order_id': order.pk, 'new_order_status': 'delivered'},
+                          format='json')
+        self.assertEqual(Payment.objects.get().amount, -order.total_price)
+
+    def test_rolled_back_price_not_cached(self):
+        customer = self.customers[0]
+        self.assertEqual(pricing.get_price_per_bottle(customer.pk), pricing.DEFAULT_PRICE_PER_BOTTLE)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            customer.specialBottlePrice = 15
+            customer.save()
+            pricing.get_price_per_bottle(customer.pk)
+            raise RuntimeError
+        self.assertEqual(pricing.get_price_per_bottle(customer.pk), pricing.DEFAULT_PRICE_PER_BOTTLE)
+
+
+class BottleEventTests(OrdersTestCase):
+    """
+    The add-bottles and return-bottles flows append to the bottles' event log.
+    """
+
+    def test_bottle_lifecycle(self):
+        self.create_orders(1, OrderStatus.APPROVED)
+        order = Orders.objects.get()
+        first, second = Bottle.objects.bulk_create([Bottle(), Bottle(number_of_times_Sold=34)])
+        for bottle in (first, second):
+            response = self.client.post('/bottles/add-bottles-to-order/', {'order_id': order.pk,
+                                                                            'bottle_ids': [bottle.pk]}, format='json')
+            self.assertEqual(response.status_code, 201)
+        response = self.client.post('/bottles/return-bottles/', {'bottle_ids': [first.pk, second.pk]}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/bottles/{second.pk}/history')
+        self.assertEqual([event['event'] for event in response.data['results']],
+                         ['Issued', 'Delivered', 'Returned', 'Discarded'])
+        self.assertEqual({event['order'] for event in response.data['results']}, {order.pk})
+        self.assertEqual(list(BottleEvent.objects.filter(bottle=first).values_list('event', flat=True)),
+                         [BottleEventType.ISSUED, BottleEventType.DELIVERED, BottleEventType.RETURNED])
+
+
+class AddBottlesTests(OrdersTestCase):
+    """
+    The bottle that completes an order delivers it through the order state machine.
+    """
+
+    def add_bottles(self, order, bottles):
+        return self.client.post('/bottles/add-bottles-to-order/',
+                                {'order_id': order.pk, 'bottle_ids': [bottle.pk for bottle in bottles]}, format='json')
+
+    def test_completed_order_delivered_and_charged(self):
+        self.create_orders(1, OrderStatus.APPROVED)
+        order = Orders.objects.get()
+        response = self.add_bottles(order, Bottle.objects.bulk_create([Bottle(), Bottle()]))
+        self.assertEqual(response.status_code, 201)
+        order.refresh_from_db()
+        self.assertEqual(order.order_status, OrderStatus.DELIVERED)
+        self.assertEqual(Payment.objects.get().amount, -order.total_price)
+
+    def test_query_count(self):
+        customer = self.customers[0]
+        for count in (2, 10):
+            # One bottle short of the order, the delivery payment is covered by the change-status tests
+            order = Orders.objects.create(order_quantity=count + 1, customer=customer,
+                                          address=customer.addresses.get(), order_status=OrderStatus.APPROVED)
+            bottles = Bottle.objects.bulk_create([Bottle() for _ in range(count)])
+            with self.assertNumQueries(9):  # Inside the test's savepoint
+                response = self.add_bottles(order, bottles)
+            self.assertEqual(response.status_code, 201)
+
+    def test_more_bottles_than_ordered(self):
+        self.create_orders(1, OrderStatus.APPROVED)
+        order = Orders.objects.get()
+        self.add_bottles(order, [Bottle.objects.create()])
+        response = self.add_bottles(order, Bottle.objects.bulk_create([Bottle(), Bottle()]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], f'order {order.pk} only takes 1 more bottles')
+        self.assertEqual(order.bottles.count(), 1)
+
+    def test_order_delivered_through_change_status(self):
+        self.create_orders(1, OrderStatus.APPROVED)
+        order = Orders.objects.get()
+        self.client.patch('/orders/change-status/', {'order_id': order.pk, 'new_order_status': 'delivered'},
+                          format='json')
+        bottles = Bottle.objects.bulk_create([Bottle(), Bottle()])
+        for bottle in bottles:
+            response = self.add_bottles(order, [bottle])
+            self.assertEqual(response.status_code, 201)
+
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(CustomUser.objects.get(pk=order.customer_id).outstanding_bottles, 2)
+        self.assertEqual(list(BottleEvent.objects.filter(bottle=bottles[0]).values_list('event', flat=True)),
+                         [BottleEventType.ISSUED, BottleEventType.DELIVERED])
+        response = self.client.post('/bottles/return-bottles/', {'bottle_ids': [bottles[0].pk]}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_cancelled_order_rejected(self):
+        self.create_orders(1, OrderStatus.CANCELLED)
+        order = Orders.objects.get()
+        bottles = Bottle.objects.bulk_create([Bottle(), Bottle()])
+        response = self.add_bottles(order, bottles)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'cant add bottles to a cancelled order')
+        order.refresh_from_db()
+        self.assertEqual(order.order_status, OrderStatus.CANCELLED)
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(Bottle.objects.filter(bottle_status=BottleStatus.SOLD).count(), 0)
+
+
+class ReturnBottlesTests(OrdersTestCase):
+    """
+    Returned bottles are counted once, and discarded on their DISCARD_THRESHOLD-th sale.
+    """
+
+    def deliver(self, *bottles):
+        self.create_orders(1, OrderStatus.APPROVED)
+        order = Orders.objects.latest('pk')
+        self.client.post('/bottles/add-bottles-to-order/', {'order_id': order.pk,
+                                                            'bottle_ids': [bottle.pk for bottle in bottles]},
+                         format='json')
+
+    def test_discard_threshold(self):
+        bottles = Bottle.objects.bulk_create([Bottle(number_of_times_Sold=33), Bottle(number_of_times_Sold=34)])
+        self.deliver(*bottles)
+        response = self.client.post('/bottles/return-bottles/', {'bottle_ids': [bottle.pk for bottle in bottles]},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Bottle.objects.order_by('pk').values_list('number_of_times_Sold', 'bottle_status')),
+                         [(34, BottleStatus.AVAILABLE), (35, BottleStatus.DISCARDED)])
+
+    def test_concurrent_return(self):
+        bottle = Bottle.objects.create()
+        self.deliver(bottle)
+        serializers = [ReturnBottlesSerializer(data={'bottle_ids': [bottle.pk]}) for _ in range(2)]
+        for serializer in serializers:
+            self.assertTrue(serializer.is_valid())
+
+        serializers[0].update(None, serializers[0].validated_data)
+        with self.assertRaises(ValidationError):
+            serializers[1].update(None, serializers[1].validated_data)
+        bottle.refresh_from_db()
+        self.assertEqual(bottle.number_of_times_Sold, 1)
+        self.assertEqual(CustomUser.objects.get(pk=self.customers[0].pk).outstanding_bottles, 0)
+        self.assertEqual(BottleEvent.objects.filter(event=BottleEventType.RETURNED).count(), 1)
+
+
+class OutstandingBottlesTests(OrdersTestCase):
+    """
+    The customers' outstanding bottle counters follow the add-bottles and return-bottles flows.
+    """
+
+    def test_counter(self):
+        self.create_orders(2, OrderStatus.APPROVED)
+        bottles = Bottle.objects.bulk_create([Bottle() for _ in range(4)])
+        for order, order_bottles in zip(Orders.objects.order_by('pk'), (bottles[:2], bottles[2:])):
+            self.client.post('/bottles/add-bottles-to-order/',
+                             {'order_id': order.pk, 'bottle_ids': [bottle.pk for bottle in order_bottles]},
+                             format='json')
+        self.client.post('/bottles/return-bottles/', {'bottle_ids': [bottles[0].pk]}, format='json')
+
+        response = self.client.get('/customers/outstanding-bottles/')
+        self.assertEqual([(row['id'], row['outstanding_bottles']) for row in response.data['results']],
+                         [(self.customers[1].pk, 2), (self.customers[0].pk, 1)])
+
+        output = StringIO()
+        call_command('reconcile_outstanding_bottles', dry_run=True, stdout=output)
+        self.assertIn('found 0 drifted', output.getvalue())
+
+    def test_user_save_keeps_counter(self):
+        self.create_orders(1, OrderStatus.APPROVED)
+        customer = CustomUser.objects.get(pk=self.customers[0].pk)
+        self.client.post('/bottles/add-bottles-to-order/',
+                         {'order_id': Orders.objects.get().pk, 'bottle_ids': [Bottle.objects.create().pk]},
+                         format='json')
+        customer.phone_number = '555-0100'
+        customer.save()
+        self.assertEqual(CustomUser.objects.get(pk=customer.pk).outstanding_bottles, 1)
+
+
+class BenchmarkTests(TestCase):
+    """
+    The benchmark suite runs every scenario without errors on a small seeded dataset.
+    """
+
+    def test_benchmark_report(self):
+        self.addCleanup(pricing.reset)
+        call_command('seed_benchmark_data', customers=3, employees=2, orders=20, bottles=10, payments=10,
+                     stdout=StringIO())
+        output = StringIO()
+        # The test client's host, the only one allowed besides ALLOWED_HOSTS while testing
+        call_command('benchmark_api', iterations=2, warmup=0, host='testserver', stdout=output)
+        report = json.loads(output.getvalue())
+
+        self.assertEqual(report['dataset']['orders'], 20)
+        self.assertEqual(list(report['scenarios']), list(BenchmarkRunner.scenarios))
+        for name, scenario in report['scenarios'].items():
+            self.assertEqual(scenario['errors'], 0, name)
+            self.assertIsNotNone(scenario['queries'], name)
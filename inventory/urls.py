@@ -4,10 +4,17 @@ from . import views
 urlpatterns = [
     path('orders/', views.OrdersListCreateAPIView.as_view(), name='orders'),
     path('orders/customer/<int:customer_id>', views.OrdersListCreateAPIView.as_view(), name='orders_customer'),
+    path('orders/import/', views.OrdersImportAPIView.as_view(), name='orders_import'),
     path('orders/<int:pk>', views.OrdersDetailAPIView.as_view(), name='orders_details'),
     path('orders/change-status/', views.ChangeOrderStatusAPIView.as_view(), name='change-order-status'),
+    path('orders/change-status/bulk/', views.BulkChangeOrderStatusAPIView.as_view(), name='change-order-status-bulk'),
     path('bottles/', views.BottleListCreateAPIView.as_view(), name='bottle-list-create'),
+    path('bottles/<int:pk>/qr.png', views.BottleQRCodeView.as_view(image_format='png'), name='bottle-qr-png'),
+    path('bottles/<int:pk>/qr.svg', views.BottleQRCodeView.as_view(image_format='svg'), name='bottle-qr-svg'),
+    path('bottles/<int:pk>/history', views.BottleHistoryAPIView.as_view(), name='bottle-history'),
+    path('bottles/batch/', views.BottleBatchCreateAPIView.as_view(), name='bottle-batch-create'),
     path('bottles/add-bottles-to-order/', views.BottleOrderView.as_view(), name='add-bottles-to-order'),
     path('bottles/return-bottles/', views.ReturnBottlesView.as_view(), name='return-bottles'),
+    path('exports/<slug:dataset>.<slug:file_format>', views.ExportAPIView.as_view(), name='export'),
 
 ]
@@ -1,12 +1,24 @@
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
 from rest_framework import generics, permissions, status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from .models import Orders, Bottle, OrderStatus
+from .models import Orders, Bottle, BottleEvent, ORDER_STATUS_PRIORITY, ACTIVE_ORDER_STATUSES
+from .exports import EXPORTS, EXPORT_FORMATS, stream_export
+from .order_cache import customer_orders_key, get_cache
+from .qr import QR_CODE_FORMATS, get_qr_code_file, qr_code_key, schedule_qr_codes, stream_qr_labels
 from .serializers import (OrdersSerializer, ChangeOrderStatusSerializer, BottleSerializer, BottleOrderSerializer,
-                          ReturnBottlesSerializer)
+                          ReturnBottlesSerializer, BottleBatchSerializer, ExportFilterSerializer,
+                          OrderImportSerializer, BulkChangeOrderStatusSerializer, BottleEventSerializer)
 from .permissions import CanChangeOrderStatusPermission, IsAdminUserCustom
 from myapp.models import UserTypes
-from django.db.models import Case, When, Value, IntegerField
+from myapp.pagination import KeysetPagination
+from myapp.permissions import IsNotCustomer
 from django.db.models.functions import Coalesce
 
 
@@ -14,24 +26,50 @@ class OrdersListCreateAPIView(generics.ListCreateAPIView):
     queryset = Orders.objects.all()
     serializer_class = OrdersSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    @property
+    def keyset_ordering(self):
+        if self.kwargs.get('customer_id'):
+            return ('-order_date', '-id')
+        return ('status_priority', 'order_date', 'id')
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = self.serializer_class.setup_eager_loading(super().get_queryset())
         customer_id = self.kwargs.get('customer_id')
         if customer_id:
             return queryset.filter(customer_id=customer_id).order_by('-order_date')
         elif self.request.user.type == UserTypes.CUSTOMER:
             return queryset.none()  # Return an empty queryset instead of an empty list
-        return queryset.annotate(
-            custom_order=Case(
-                When(order_status=OrderStatus.PENDING, then=Value(1)),
-                When(order_status=OrderStatus.APPROVED, then=Value(2)),
-                When(order_status=OrderStatus.DELIVERED, then=Value(3)),
-                When(order_status=OrderStatus.CANCELLED, then=Value(4)),
-                default=Value(5),
-                output_field=IntegerField()
+        if self.request.query_params.get('active') in ('1', 'true'):
+            # Only the orders dispatchers still have to act on, a range scan on the queue index
+            queryset = queryset.filter(
+                status_priority__lte=max(ORDER_STATUS_PRIORITY[status] for status in ACTIVE_ORDER_STATUSES)
             )
-        ).order_by('custom_order', 'order_date')
+        return queryset.order_by('status_priority', 'order_date')
+
+    def list(self, request, *args, **kwargs):
+        customer_id = self.kwargs.get('customer_id')
+        if not customer_id:
+            return super().list(request, *args, **kwargs)
+
+        # Customer apps poll this list, serve it from the cache until one of the customer's rows changes
+        cache = get_cache()
+        key = customer_orders_key(customer_id, request.build_absolute_uri())
+        cached = cache.get(key)
+        if cached is None:
+            data = super().list(request, *args, **kwargs).data
+            etag = f'"{hashlib.sha1(JSONRenderer().render(data)).hexdigest()}"'
+            cached = (etag, data)
+            cache.set(key, cached, settings.ORDERS_CACHE_TTL)
+
+        etag, data = cached
+        if etag in request.headers.get('If-None-Match', ''):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        return response
 
     def create(self, request, *args, **kwargs):
         response = super(OrdersListCreateAPIView, self).create(request, *args, **kwargs)
@@ -40,11 +78,26 @@ class OrdersListCreateAPIView(generics.ListCreateAPIView):
         return response
 
 
+class OrdersImportAPIView(APIView):
+    permission_classes = [IsNotCustomer]
+
+    def post(self, request, *args, **kwargs):
+        serializer = OrderImportSerializer(data=request.data)
+        if serializer.is_valid():
+            orders = serializer.save()
+            return Response({'message': f'{len(orders)} orders imported successfully!'},
+                            status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
 class OrdersDetailAPIView(generics.RetrieveAPIView):
     queryset = Orders.objects.all()
     serializer_class = OrdersSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_queryset(self):
+        return self.serializer_class.setup_eager_loading(super().get_queryset())
+
 
 class ChangeOrderStatusAPIView(APIView):
     permission_classes = [CanChangeOrderStatusPermission]
@@ -59,10 +112,74 @@ class ChangeOrderStatusAPIView(APIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class BulkChangeOrderStatusAPIView(APIView):
+    permission_classes = [CanChangeOrderStatusPermission]
+
+    def patch(self, request, *args, **kwargs):
+        serializer = BulkChangeOrderStatusSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        updated = serializer.update_order_statuses(serializer.validated_data)
+        return Response({'message': f'{updated} orders updated', 'results': serializer.results},
+                        status=status.HTTP_200_OK if updated else status.HTTP_400_BAD_REQUEST)
+
+
 class BottleListCreateAPIView(generics.ListCreateAPIView):
-    queryset = Bottle.objects.all()
+    # The stored QR code is not part of the listing, the serializer links to the image endpoint instead
+    queryset = Bottle.objects.defer('qr_code')
     serializer_class = BottleSerializer
     permission_classes = [IsAdminUserCustom]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('bottleId',)
+
+
+class BottleHistoryAPIView(generics.ListAPIView):
+    serializer_class = BottleEventSerializer
+    permission_classes = [IsAdminUserCustom]
+    pagination_class = KeysetPagination
+    # Served by the (bottle, timestamp, id) index
+    keyset_ordering = ('timestamp', 'id')
+
+    def get_queryset(self):
+        return BottleEvent.objects.filter(bottle_id=self.kwargs['pk'])
+
+
+class BottleQRCodeView(APIView):
+    permission_classes = [IsAdminUserCustom]
+    image_format = 'png'
+
+    def get(self, request, pk, *args, **kwargs):
+        # The image only depends on the bottle id, so the ETag is known before anything is rendered
+        etag = f'"{qr_code_key(pk, self.image_format)}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            if not Bottle.objects.filter(pk=pk).exists():
+                raise Http404
+            response = FileResponse(open(get_qr_code_file(pk, self.image_format), 'rb'),
+                                    content_type=QR_CODE_FORMATS[self.image_format])
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
+
+class BottleBatchCreateAPIView(APIView):
+    permission_classes = [IsAdminUserCustom]
+
+    def post(self, request, *args, **kwargs):
+        serializer = BottleBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        bottle_ids = serializer.save()
+        if serializer.validated_data['format'] == 'zip':
+            # The labels are rendered (and stored) while the archive is streamed to the client
+            response = StreamingHttpResponse(stream_qr_labels(bottle_ids), content_type='application/zip')
+            response['Content-Disposition'] = 'attachment; filename="bottle-labels.zip"'
+            return response
+
+        transaction.on_commit(lambda: schedule_qr_codes(bottle_ids))
+        return Response({'message': f'{len(bottle_ids)} bottles created', 'bottle_ids': bottle_ids},
+                        status=status.HTTP_201_CREATED)
 
 
 class BottleOrderView(APIView):
@@ -71,9 +188,11 @@ class BottleOrderView(APIView):
         if serializer.is_valid():
             result = serializer.save()
             if isinstance(result, Orders):
-                return Response({'status': 'bottles added to order'}, status=status.HTTP_201_CREATED)
+                return Response({'status': 'bottles added to order', 'results': serializer.bottle_results},
+                                status=status.HTTP_201_CREATED)
             else:
-                return Response({'message': result['status']}, status=status.HTTP_400_BAD_REQUEST)
+                return Response({'message': result['status'], 'results': result['results']},
+                                status=status.HTTP_400_BAD_REQUEST)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -85,3 +204,21 @@ class ReturnBottlesView(APIView):
             serializer.update(None, serializer.validated_data)
             return Response({'message': 'bottles returned'}, status=status.HTTP_200_OK)
         return Response({'message': 'one or more of bottles is returned'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ExportAPIView(APIView):
+    permission_classes = [IsNotCustomer]
+
+    def get(self, request, dataset, file_format, *args, **kwargs):
+        if dataset not in EXPORTS or file_format not in EXPORT_FORMATS:
+            raise Http404
+        serializer = ExportFilterSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        filters = serializer.validated_data
+        rows = stream_export(dataset, file_format, date_from=filters.get('date_from'),
+                             date_to=filters.get('date_to'), customer_id=filters.get('customer'))
+        response = StreamingHttpResponse(rows, content_type=EXPORT_FORMATS[file_format])
+        response['Content-Disposition'] = f'attachment; filename="{dataset}.{file_format}"'
+        return response
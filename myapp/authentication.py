@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import CustomUser
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that builds request.user from the token claims instead of loading it.
+
+    The user is a CustomUser instance holding only id, username, type and is_active; any other
+    field is deferred and loaded on first access, so views that need more still work. It cannot be
+    saved, views that write to the user must load it from the database. Tokens
+    issued before the 'type' claim existed fall back to the database lookup.
+    When JWT_USER_CACHE_TTL is set, whether the account is still active is checked against a
+    short-lived cache, so a deactivated user is locked out within that many seconds.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN or 'type' not in validated_token:
+            return super().get_user(validated_token)
+
+        try:
+            user_id = int(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        is_active = self.is_user_active(user_id)
+        if is_active is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        loaded = {
+            'id': user_id,
+            'username': validated_token.get('userName', ''),
+            'type': validated_token['type'],
+            'is_active': is_active,
+        }
+        # from_db() expects the values in field order and defers every field that is not given
+        field_names = [field.attname for field in CustomUser._meta.concrete_fields if field.attname in loaded]
+        user = CustomUser.from_db('default', field_names, [loaded[name] for name in field_names])
+        # Saving it would write the token's (possibly outdated) username and type back to the database
+        user.from_token_claims = True
+        return user
+
+    def is_user_active(self, user_id):
+        ttl = getattr(settings, 'JWT_USER_CACHE_TTL', 0)
+        if not ttl:
+            return True
+
+        key = f'auth:user:{user_id}:active'
+        is_active = cache.get(key)
+        if is_active is None:
+            is_active = CustomUser.objects.filter(pk=user_id).values_list('is_active', flat=True).first()
+            if is_active is None:
+                return None
+            cache.set(key, is_active, ttl)
+        return is_active
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+
+from myapp.models import Payment, PaymentRollup, RollupPeriod
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily and monthly payment rollups from the raw payments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        buckets = {
+            RollupPeriod.DAY: TruncDate('created_at'),
+            RollupPeriod.MONTH: TruncMonth('created_at', output_field=models.DateField()),
+        }
+
+        with transaction.atomic():
+            PaymentRollup.objects.all().delete()
+            for period, bucket in buckets.items():
+                rows = Payment.objects.annotate(bucket=bucket).values('customer_id', 'bucket').annotate(
+                    total=Sum('amount'), count=Count('id'), low=Min('amount'), high=Max('amount')
+                ).order_by()
+
+                batch = []
+                created = 0
+                for row in rows.iterator(chunk_size=batch_size):
+                    batch.append(PaymentRollup(
+                        period=period, period_start=row['bucket'], customer_id=row['customer_id'],
+                        total=row['total'], count=row['count'], min_amount=row['low'], max_amount=row['high'],
+                    ))
+                    if len(batch) >= batch_size:
+                        created += len(PaymentRollup.objects.bulk_create(batch))
+                        batch = []
+                created += len(PaymentRollup.objects.bulk_create(batch))
+                self.stdout.write(f'{created} {RollupPeriod(period).label.lower()} rollups')
+
+        self.stdout.write(self.style.SUCCESS('Payment rollups rebuilt'))
@@ -0,0 +1,73 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import identify_hasher
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from myapp.models import CustomUser, UserTypes
+
+
+class Command(BaseCommand):
+    help = 'Measure the password hashing cost and the login latency (p50/p99) under concurrent load.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--username', default='benchmark-login')
+        parser.add_argument('--password', default='benchmark-login-password')
+        parser.add_argument('--host', default='localhost', help='Host header, must be in ALLOWED_HOSTS.')
+
+    def handle(self, *args, **options):
+        username, password = options['username'], options['password']
+        user, created = CustomUser.objects.get_or_create(
+            username=username, defaults={'email': f'{username}@example.com', 'type': UserTypes.CUSTOMER}
+        )
+        if created:
+            user.set_password(password)
+            user.save()
+        elif not user.check_password(password):
+            raise CommandError(f'Wrong password for {username}')
+
+        try:
+            self.report_hasher(user, password)
+            self.report_logins(username, password, options)
+        finally:
+            if created:
+                user.delete()
+
+    def report_hasher(self, user, password):
+        hasher = identify_hasher(user.password)
+        summary = ', '.join(f'{key}={value}' for key, value in hasher.safe_summary(user.password).items()
+                            if key not in ('hash', 'salt'))
+        start = time.perf_counter()
+        user.check_password(password)
+        self.stdout.write(f'password hasher: {summary}, one check {(time.perf_counter() - start) * 1000:.1f} ms')
+
+    def report_logins(self, username, password, options):
+        url = reverse('login')
+
+        def login(_):
+            client = Client(HTTP_HOST=options['host'])
+            start = time.perf_counter()
+            response = client.post(url, {'username': username, 'password': password}, content_type='application/json')
+            elapsed = time.perf_counter() - start
+            connections.close_all()
+            if response.status_code != 200:
+                raise CommandError(f'Login failed with status {response.status_code}')
+            return elapsed
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            timings = sorted(pool.map(login, range(options['requests'])))
+        total = time.perf_counter() - start
+
+        percentiles = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+        self.stdout.write(
+            f"{len(timings)} logins, concurrency {options['concurrency']}: "
+            f"p50 {percentiles[49] * 1000:.1f} ms, p99 {percentiles[98] * 1000:.1f} ms, "
+            f"{len(timings) / total:.1f} logins/s"
+        )
@@ -0,0 +1,40 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from myapp.models import CustomUser, Payment
+
+
+class Command(BaseCommand):
+    help = "Rebuild the customers' wallet balances from their payments and report any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drift, do not fix it.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # Lock the balances before summing the payments: a payment committed between the two
+            # reads would otherwise be counted in the stored balance but not in the expected total
+            balances = list(CustomUser.objects.select_for_update().order_by('pk').values_list(
+                'pk', 'username', 'wallet_balance'
+            ))
+            totals = dict(
+                Payment.objects.order_by().values('customer_id').annotate(total=Sum('amount'))
+                .values_list('customer_id', 'total')
+            )
+
+            drifted = []
+            for pk, username, balance in balances:
+                expected = totals.get(pk) or Decimal('0.00')
+                if balance != expected:
+                    self.stdout.write(f'{username} (#{pk}): stored {balance}, expected {expected}')
+                    drifted.append(CustomUser(pk=pk, wallet_balance=expected))
+
+            if drifted and not options['dry_run']:
+                CustomUser.objects.bulk_update(drifted, ['wallet_balance'], batch_size=options['batch_size'])
+
+        action = 'found' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'{action} {len(drifted)} drifted wallet balances'))
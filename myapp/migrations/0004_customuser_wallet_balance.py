@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:34
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def populate_wallet_balances(apps, schema_editor):
+    CustomUser = apps.get_model('myapp', 'CustomUser')
+    Payment = apps.get_model('myapp', 'Payment')
+    totals = Payment.objects.values('customer_id').annotate(total=Sum('amount')).order_by()
+    users = [CustomUser(pk=row['customer_id'], wallet_balance=row['total']) for row in totals]
+    CustomUser.objects.bulk_update(users, ['wallet_balance'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0003_alter_customuser_specialbottleprice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='wallet_balance',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.RunPython(populate_wallet_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:08
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+import django.db.models.deletion
+
+
+def populate_payment_rollups(apps, schema_editor):
+    Payment = apps.get_model('myapp', 'Payment')
+    PaymentRollup = apps.get_model('myapp', 'PaymentRollup')
+    buckets = {
+        'D': TruncDate('created_at'),
+        'M': TruncMonth('created_at', output_field=models.DateField()),
+    }
+    for period, bucket in buckets.items():
+        rows = Payment.objects.annotate(bucket=bucket).values('customer_id', 'bucket').annotate(
+            total=Sum('amount'), count=Count('id'), low=Min('amount'), high=Max('amount')
+        ).order_by()
+        PaymentRollup.objects.bulk_create([
+            PaymentRollup(period=period, period_start=row['bucket'], customer_id=row['customer_id'],
+                          total=row['total'], count=row['count'], min_amount=row['low'], max_amount=row['high'])
+            for row in rows
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0005_payment_payment_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('D', 'Day'), ('M', 'Month')], max_length=1)),
+                ('period_start', models.DateField()),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('min_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('max_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='paymentrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'period_start', 'customer'), name='payment_rollup_unique'),
+        ),
+        migrations.RunPython(populate_payment_rollups, migrations.RunPython.noop),
+    ]
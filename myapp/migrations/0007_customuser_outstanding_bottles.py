@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:24
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_outstanding_bottles(apps, schema_editor):
+    CustomUser = apps.get_model('myapp', 'CustomUser')
+    BottleOrder = apps.get_model('inventory', 'BottleOrder')
+    counts = BottleOrder.objects.filter(dateOfReturning__isnull=True).values('order__customer_id').annotate(
+        count=Count('id')
+    ).order_by()
+    users = [CustomUser(pk=row['order__customer_id'], outstanding_bottles=row['count']) for row in counts]
+    CustomUser.objects.bulk_update(users, ['outstanding_bottles'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0006_paymentrollup'),
+        ('inventory', '0011_bottleevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='outstanding_bottles',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_outstanding_bottles, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['outstanding_bottles', 'id'], name='customuser_outstanding_idx'),
+        ),
+    ]
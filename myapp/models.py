@@ -1,4 +1,7 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import Greatest, Least, TruncDate, TruncMonth
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser, User
 from django.conf import settings
 from rest_framework.exceptions import ValidationError
@@ -16,10 +19,53 @@ class CustomUser(AbstractUser):
     phone_number = models.CharField(max_length=100, null=True, blank=True)
     email = models.EmailField(unique=True)  # Make email unique
     specialBottlePrice = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    # Sum of the customer's payments, maintained by Payment so it never has to be aggregated on read
+    wallet_balance = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    # Bottles sold to the customer and not returned yet, maintained by the add-bottles and return-bottles flows
+    outstanding_bottles = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         verbose_name = 'Custom User'
         verbose_name_plural = 'Custom Users'
+        indexes = [
+            # Customers holding the most bottles first, for deposit and collection planning
+            models.Index(fields=['outstanding_bottles', 'id'], name='customuser_outstanding_idx'),
+        ]
+
+    # Set on the users ClaimsJWTAuthentication builds from token claims, whose values may be stale
+    from_token_claims = False
+    # Maintained with F() updates, the value an instance loaded earlier must never be written back
+    COUNTER_FIELDS = ('wallet_balance', 'outstanding_bottles')
+
+    def save(self, *args, **kwargs):
+        if self.from_token_claims:
+            raise TypeError('A user built from token claims cannot be saved, load it from the database first.')
+        if not args and not self._state.adding and kwargs.get('update_fields') is None \
+                and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def add_to_wallets(cls, amounts):
+        """
+        Atomically add {customer_id: amount} to the customers' wallet balances.
+        """
+        for customer_id, amount in amounts.items():
+            if amount:
+                cls.objects.filter(pk=customer_id).update(wallet_balance=F('wallet_balance') + amount)
+
+    @classmethod
+    def add_outstanding_bottles(cls, counts):
+        """
+        Atomically add {customer_id: count} to the customers' outstanding bottles, counts may be negative.
+        """
+        for customer_id, count in counts.items():
+            if count:
+                cls.objects.filter(pk=customer_id).update(outstanding_bottles=F('outstanding_bottles') + count)
 
 
 class Address(models.Model):
@@ -32,6 +78,21 @@ class Address(models.Model):
             raise ValidationError("Only customers can have addresses.")
 
 
+class PaymentQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            amounts = {}
+            for payment in objs:
+                amounts[payment.customer_id] = amounts.get(payment.customer_id, 0) + payment.amount
+            CustomUser.add_to_wallets(amounts)
+            PaymentRollup.add_payments(objs)
+            # Imported here, the dashboard app depends on this one
+            from dashboard.kpis import invalidate_kpis_on_commit
+            invalidate_kpis_on_commit()
+        return objs
+
+
 class Payment(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -48,3 +109,121 @@ class Payment(models.Model):
         limit_choices_to={'type__in': ['admin', 'driver', 'customerService']},
         null=True
     )
+
+    objects = PaymentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of all payments and of a customer's payments, newest first
+            models.Index(fields=['created_at', 'id'], name='payment_created_idx'),
+            models.Index(fields=['customer', 'created_at', 'id'], name='payment_customer_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            adding = self._state.adding
+            amounts = {self.customer_id: self.amount}
+            previous = None
+            if not adding:
+                # An edited payment moves the difference (or the whole amount to another customer)
+                previous = Payment.objects.filter(pk=self.pk).values('customer_id', 'amount', 'created_at').first()
+                if previous:
+                    amounts[previous['customer_id']] = amounts.get(previous['customer_id'], 0) - previous['amount']
+            super().save(*args, **kwargs)
+            CustomUser.add_to_wallets(amounts)
+
+            if adding:
+                PaymentRollup.add_payments([self])
+            else:
+                # Minimums and maximums cannot be taken back, so rebuild the affected buckets instead
+                PaymentRollup.rebuild(self.customer_id, self.created_at)
+                if previous:
+                    PaymentRollup.rebuild(previous['customer_id'], previous['created_at'])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            CustomUser.add_to_wallets({self.customer_id: -self.amount})
+            PaymentRollup.rebuild(self.customer_id, self.created_at)
+        return result
+
+
+class RollupPeriod(models.TextChoices):
+    DAY = 'D', 'Day'
+    MONTH = 'M', 'Month'
+
+
+class PaymentRollup(models.Model):
+    """
+    Sum, count, minimum and maximum of a customer's payments per day and per month,
+    maintained as payments are written so reports never have to scan Payment.
+    """
+    period = models.CharField(max_length=1, choices=RollupPeriod.choices)
+    period_start = models.DateField()
+    customer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='payment_rollups')
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+    min_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    max_amount = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'period_start', 'customer'], name='payment_rollup_unique'),
+        ]
+
+    @staticmethod
+    def period_starts(created_at):
+        day = timezone.localdate(created_at)
+        return {RollupPeriod.DAY: day, RollupPeriod.MONTH: day.replace(day=1)}
+
+    @classmethod
+    def add_payments(cls, payments):
+        # Fold the payments per bucket first, so a batch costs one upsert per bucket
+        buckets = {}
+        for payment in payments:
+            for period, period_start in cls.period_starts(payment.created_at).items():
+                key = (period, period_start, payment.customer_id)
+                total, count, low, high = buckets.get(key, (0, 0, payment.amount, payment.amount))
+                buckets[key] = (total + payment.amount, count + 1, min(low, payment.amount), max(high, payment.amount))
+
+        for (period, period_start, customer_id), (total, count, low, high) in buckets.items():
+            rollup = cls.objects.filter(period=period, period_start=period_start, customer_id=customer_id)
+            values = {
+                'total': F('total') + total,
+                'count': F('count') + count,
+                'min_amount': Least(F('min_amount'), low),
+                'max_amount': Greatest(F('max_amount'), high),
+            }
+            if rollup.update(**values):
+                continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(period=period, period_start=period_start, customer_id=customer_id,
+                                       total=total, count=count, min_amount=low, max_amount=high)
+            except IntegrityError:
+                # Created concurrently by another payment of the same bucket
+                rollup.update(**values)
+
+    @classmethod
+    def rebuild(cls, customer_id, created_at):
+        """
+        Recompute the day and month buckets of one customer from the raw payments.
+        """
+        for period, period_start in cls.period_starts(created_at).items():
+            payments = Payment.objects.filter(customer_id=customer_id)
+            if period == RollupPeriod.DAY:
+                payments = payments.annotate(bucket=TruncDate('created_at')).filter(bucket=period_start)
+            else:
+                payments = payments.annotate(bucket=TruncMonth('created_at', output_field=models.DateField())).filter(
+                    bucket=period_start
+                )
+            figures = payments.aggregate(total=Sum('amount'), count=Count('id'), low=Min('amount'), high=Max('amount'))
+
+            rollup = cls.objects.filter(period=period, period_start=period_start, customer_id=customer_id)
+            if not figures['count']:
+                rollup.delete()
+            elif not rollup.update(total=figures['total'], count=figures['count'], min_amount=figures['low'],
+                                   max_amount=figures['high']):
+                cls.objects.create(period=period, period_start=period_start, customer_id=customer_id,
+                                   total=figures['total'], count=figures['count'], min_amount=figures['low'],
+                                   max_amount=figures['high'])
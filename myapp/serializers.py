@@ -1,7 +1,6 @@
-from decimal import Decimal
-
 from django.contrib.auth import authenticate
-from django.db.models import Sum, Q
+from django.db.models import OuterRef, Q, Subquery
+from inventory.models import Orders
 from rest_framework import serializers
 from .models import CustomUser as User, Payment
 from .models import Address, UserTypes
@@ -29,6 +28,12 @@ class AddressSerializer(serializers.ModelSerializer):
         return address
 
 
+class OutstandingBottlesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ('id', 'username', 'phone_number', 'outstanding_bottles')
+
+
 class UserSerializer(serializers.ModelSerializer):
     addresses = AddressSerializer(many=True, required=False)
     password = serializers.CharField(write_only=True, required=False, style={'input_type': 'password'})
@@ -40,10 +45,18 @@ class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'password', 'email', 'first_name', 'last_name', 'type', 'addresses', 'service_type',
-                  'wallet_balance', 'phone_number', 'specialBottlePrice', 'last_order_date')
+                  'wallet_balance', 'outstanding_bottles', 'phone_number', 'specialBottlePrice', 'last_order_date')
         extra_kwargs = {'specialBottlePrice': {'required': False}}
 
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        # Compute the last order date in SQL instead of one query per user
+        last_order = Orders.objects.filter(customer=OuterRef('pk')).order_by('-order_date').values('order_date')[:1]
+        return queryset.prefetch_related('addresses').annotate(last_order_at=Subquery(last_order))
+
     def get_last_order_date(self, obj):
+        if hasattr(obj, 'last_order_at'):
+            return obj.last_order_at
         # Filter orders by this user, order by date descending
         last_order = obj.customer.order_by('-order_date').first()
         if last_order:
@@ -57,12 +70,8 @@ class UserSerializer(serializers.ModelSerializer):
     def get_wallet_balance(self, obj):
         if obj.type != 'C':
             return 0
-
-        balance = obj.payments_as_customer.aggregate(
-            total_balance=Sum('amount')
-        )['total_balance'] or Decimal('0.00')
-
-        return balance
+        # Maintained by Payment on every write, see CustomUser.wallet_balance
+        return obj.wallet_balance
 
     def validate(self, attrs):
         super().validate(attrs)
@@ -102,8 +111,6 @@ class LoginSerializer(serializers.Serializer):
         username = attrs.get('username')
         password = attrs.get('password')
 
-        print(username, password)
-
         if username and password:
             user = authenticate(username=username, password=password)
 
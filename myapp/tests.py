@@ -0,0 +1,284 @@
+import base64
+import datetime
+import json
+from importlib import import_module
+
+from django.apps import apps
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from inventory.models import Orders
+from myapp.authentication import ClaimsJWTAuthentication
+from myapp.models import Address, CustomUser, Payment, PaymentRollup, RollupPeriod, UserTypes
+from myapp.pagination import KeysetPagination
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+class ClaimsJWTAuthenticationTests(TestCase):
+    """
+    JWT requests are authenticated from the token claims, without loading the user.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('admin', 'admin@example.com', 'pass', type=UserTypes.Admin)
+
+    def setUp(self):
+        cache.clear()
+        self.authentication = ClaimsJWTAuthentication()
+
+    def get_user(self, with_type=True):
+        refresh = RefreshToken.for_user(self.user)
+        refresh['userName'] = self.user.username
+        if with_type:
+            refresh['type'] = self.user.type
+        return self.authentication.get_user(self.authentication.get_validated_token(str(refresh.access_token)))
+
+    @override_settings(JWT_USER_CACHE_TTL=0)
+    def test_no_query(self):
+        with self.assertNumQueries(0):
+            user = self.get_user()
+        self.assertEqual((user.pk, user.username, user.type), (self.user.pk, 'admin', UserTypes.Admin))
+
+    @override_settings(JWT_USER_CACHE_TTL=0)
+    def test_login_token_claims(self):
+        # One query for authenticate(), which needs the full row to check the password
+        with self.assertNumQueries(1):
+            response = APIClient().post('/users/login/', {'username': 'admin', 'password': 'pass'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        token = AccessToken(response.data['token'])
+        self.assertEqual((token['userId'], token['userName'], token['type']),
+                         (self.user.pk, 'admin', UserTypes.Admin))
+
+        with self.assertNumQueries(0):
+            user = self.authentication.get_user(self.authentication.get_validated_token(response.data['token']))
+        self.assertTrue(user.from_token_claims)
+        self.assertEqual((user.pk, user.username, user.type), (self.user.pk, 'admin', UserTypes.Admin))
+
+    @override_settings(JWT_USER_CACHE_TTL=30)
+    def test_active_flag_cached(self):
+        with self.assertNumQueries(1):
+            self.get_user()
+        with self.assertNumQueries(0):
+            self.get_user()
+
+    @override_settings(JWT_USER_CACHE_TTL=30)
+    def test_inactive_user_rejected(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        with self.assertRaises(AuthenticationFailed):
+            self.get_user()
+
+    def test_token_without_type_falls_back_to_database(self):
+        with self.assertNumQueries(1):
+            user = self.get_user(with_type=False)
+        self.assertFalse(user.from_token_claims)
+        self.assertEqual(user.email, 'admin@example.com')
+
+    def test_claims_user_cannot_be_saved(self):
+        with self.assertRaises(TypeError):
+            self.get_user().save()
+
+    def test_change_password_does_not_write_back_claims(self):
+        client = APIClient()
+        response = client.post('/users/login/', {'username': 'admin', 'password': 'pass'}, format='json')
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['token']}")
+        # Demoted and renamed after the token was issued
+        CustomUser.objects.filter(pk=self.user.pk).update(type=UserTypes.DRIVER, username='driver')
+
+        passwords = {'old_password': 'pass', 'new_password': 'new-pass', 'confirm_new_password': 'new-pass'}
+        response = client.put('/users/change-password/', passwords, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.type, self.user.username), (UserTypes.DRIVER, 'driver'))
+        self.assertTrue(self.user.check_password('new-pass'))
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    List endpoints page through the rows by the keyset cursor, and reject malformed cursors.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'pass', type=UserTypes.Admin)
+        customer = CustomUser.objects.create_user('customer', 'customer@example.com', 'pass',
+                                                  type=UserTypes.CUSTOMER)
+        for amount in range(5):
+            Payment.objects.create(amount=amount, customer=customer)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_pages(self):
+        ids = []
+        url = '/payments/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [payment['id'] for payment in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, list(Payment.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_invalid_cursor(self):
+        created_at = Payment.objects.latest('id').created_at.isoformat()
+        for cursor in ('not a cursor', encode_cursor([1]), encode_cursor(['abc', 1]),
+                       encode_cursor([created_at, 'abc']), encode_cursor([created_at, [1]])):
+            with self.subTest(cursor=cursor):
+                response = self.client.get('/payments/', {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.data['detail'], KeysetPagination.invalid_cursor_message)
+
+
+class WalletBalanceTests(TestCase):
+    """
+    Payments keep the customer's wallet balance in sync, and saving a user never writes back a stale balance.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = CustomUser.objects.create_user('customer', 'customer@example.com', 'pass',
+                                                      type=UserTypes.CUSTOMER)
+
+    def assertBalance(self, balance):
+        self.assertEqual(CustomUser.objects.get(pk=self.customer.pk).wallet_balance, balance)
+
+    def test_payment_writes(self):
+        payment = Payment.objects.create(amount=10, customer=self.customer)
+        self.assertBalance(10)
+        payment.amount = 25
+        payment.save()
+        self.assertBalance(25)
+        Payment.objects.bulk_create([Payment(amount=5, customer=self.customer),
+                                     Payment(amount=-2, customer=self.customer)])
+        self.assertBalance(28)
+        payment.delete()
+        self.assertBalance(3)
+
+    def test_user_save_keeps_balance(self):
+        customer = CustomUser.objects.get(pk=self.customer.pk)
+        Payment.objects.create(amount=10, customer=customer)
+        customer.phone_number = '555-0100'
+        customer.save()
+        self.assertBalance(10)
+        self.assertEqual(CustomUser.objects.get(pk=self.customer.pk).phone_number, '555-0100')
+
+        Payment.objects.bulk_create([Payment(amount=5, customer=customer)])
+        customer.save()
+        self.assertBalance(15)
+
+
+class PaymentRollupTests(TestCase):
+    """
+    The daily and monthly payment rollups follow every way payments are written.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = CustomUser.objects.create_user('customer', 'customer@example.com', 'pass',
+                                                      type=UserTypes.CUSTOMER)
+
+    def rollups(self):
+        return {
+            (rollup.period, rollup.period_start): (rollup.total, rollup.count, rollup.min_amount, rollup.max_amount)
+            for rollup in PaymentRollup.objects.filter(customer=self.customer)
+        }
+
+    def test_add_payments(self):
+        first = timezone.make_aware(datetime.datetime(2026, 9, 30, 12))
+        second = timezone.make_aware(datetime.datetime(2026, 10, 1, 12))
+        PaymentRollup.add_payments([Payment(amount=10, customer=self.customer, created_at=first),
+                                    Payment(amount=-4, customer=self.customer, created_at=first)])
+        PaymentRollup.add_payments([Payment(amount=7, customer=self.customer, created_at=second)])
+        self.assertEqual(self.rollups(), {
+            (RollupPeriod.DAY, datetime.date(2026, 9, 30)): (6, 2, -4, 10),
+            (RollupPeriod.MONTH, datetime.date(2026, 9, 1)): (6, 2, -4, 10),
+            (RollupPeriod.DAY, datetime.date(2026, 10, 1)): (7, 1, 7, 7),
+            (RollupPeriod.MONTH, datetime.date(2026, 10, 1)): (7, 1, 7, 7),
+        })
+
+    def test_payment_writes(self):
+        first = Payment.objects.create(amount=10, customer=self.customer)
+        second = Payment.objects.create(amount=5, customer=self.customer)
+        second.amount = 20
+        second.save()
+        Payment.objects.bulk_create([Payment(amount=1, customer=self.customer)])
+        first.delete()
+
+        starts = PaymentRollup.period_starts(second.created_at)
+        self.assertEqual(self.rollups(), {(period, start): (21, 2, 1, 20) for period, start in starts.items()})
+
+    def test_rebuild(self):
+        payment = Payment.objects.create(amount=10, customer=self.customer)
+        expected = self.rollups()
+        PaymentRollup.objects.update(total=0, count=0)
+        PaymentRollup.rebuild(self.customer.pk, payment.created_at)
+        self.assertEqual(self.rollups(), expected)
+
+        # Without payments left, the buckets are removed
+        Payment.objects.all().delete()
+        PaymentRollup.rebuild(self.customer.pk, payment.created_at)
+        self.assertEqual(self.rollups(), {})
+
+    def test_migration_backfill(self):
+        Payment.objects.bulk_create([Payment(amount=amount, customer=self.customer) for amount in (3, 9)])
+        expected = self.rollups()
+        PaymentRollup.objects.all().delete()
+        import_module('myapp.migrations.0006_paymentrollup').populate_payment_rollups(apps, None)
+        self.assertEqual(self.rollups(), expected)
+
+
+class UserListQueryCountTests(TestCase):
+    """
+    The user list endpoints run a fixed number of queries, however many users they return.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'pass', type=UserTypes.Admin)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create_users(self, count):
+        for index in range(count):
+            number = CustomUser.objects.count()
+            customer = CustomUser.objects.create_user(f'customer{number}', f'customer{number}@example.com', 'pass',
+                                                      type=UserTypes.CUSTOMER, outstanding_bottles=index + 1)
+            address = Address.objects.create(title=f'address {number}', user=customer)
+            Orders.objects.create(order_quantity=1, customer=customer, address=address)
+            CustomUser.objects.create_user(f'driver{number}', f'driver{number}@example.com', 'pass',
+                                           type=UserTypes.DRIVER)
+
+    def assertConstantQueries(self, url, num):
+        for count in (1, 10):
+            self.create_users(count)
+            with self.assertNumQueries(num):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_users_list(self):
+        response = self.assertConstantQueries('/users/', 2)  # The users with their last order date, the addresses
+        self.assertEqual(len(response.data['results']), 23)
+
+    def test_customers_list(self):
+        response = self.assertConstantQueries('/customers/', 2)
+        customer = response.data['results'][0]
+        self.assertEqual(len(customer['addresses']), 1)
+        self.assertEqual(customer['last_order_date'], Orders.objects.get(customer_id=customer['id']).order_date)
+
+    def test_employees_list(self):
+        response = self.assertConstantQueries('/employees/', 2)
+        self.assertEqual(len(response.data['results']), 12)
+
+    def test_outstanding_bottles_list(self):
+        self.assertConstantQueries('/customers/outstanding-bottles/', 1)
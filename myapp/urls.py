@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     path("users/", views.UserListCreate.as_view(), name="user-list"),
     path("customers/", views.CustomersListCreate.as_view(), name="customers-list"),
+    path("customers/outstanding-bottles/", views.OutstandingBottlesList.as_view(), name="customers-outstanding-bottles"),
     path("employees/", views.EmployeesListCreate.as_view(), name="employees-list"),
     path('users/<int:pk>', views.UserEdit.as_view(), name='edit-profile'),
     path('users/login/', views.LoginView.as_view(), name='login'),
@@ -5,8 +5,10 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from .models import Address
+from .pagination import KeysetPagination
 from .permissions import IsNotCustomer
-from .serializers import UserSerializer, AddressSerializer, PaymentSerializer, LoginSerializer, ChangePasswordSerializer
+from .serializers import (UserSerializer, AddressSerializer, PaymentSerializer, LoginSerializer, ChangePasswordSerializer,
+                          OutstandingBottlesSerializer)
 from rest_framework_simplejwt.tokens import RefreshToken
 
 
@@ -14,6 +16,11 @@ class UserListCreate(generics.ListCreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsNotCustomer]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('id',)
+
+    def get_queryset(self):
+        return self.serializer_class.setup_eager_loading(super().get_queryset())
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
@@ -51,12 +58,33 @@ class CustomersListCreate(generics.ListAPIView):
     queryset = User.objects.all().filter(type=UserTypes.CUSTOMER)
     serializer_class = UserSerializer
     permission_classes = [IsNotCustomer]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('id',)
+
+    def get_queryset(self):
+        return self.serializer_class.setup_eager_loading(super().get_queryset())
+
+
+class OutstandingBottlesList(generics.ListAPIView):
+    # Customers holding bottles, most bottles first, straight from the maintained counter and its index
+    queryset = User.objects.filter(type=UserTypes.CUSTOMER, outstanding_bottles__gt=0).only(
+        'id', 'username', 'phone_number', 'outstanding_bottles'
+    )
+    serializer_class = OutstandingBottlesSerializer
+    permission_classes = [IsNotCustomer]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-outstanding_bottles', '-id')
 
 
 class EmployeesListCreate(generics.ListAPIView):
     queryset = User.objects.all().exclude(type=UserTypes.CUSTOMER)
     serializer_class = UserSerializer
     permission_classes = [IsNotCustomer]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('id',)
+
+    def get_queryset(self):
+        return self.serializer_class.setup_eager_loading(super().get_queryset())
 
 
 class LoginView(APIView):
@@ -68,29 +96,25 @@ class LoginView(APIView):
         if serializer.is_valid(raise_exception=True):
             user = serializer.validated_data['user']
             refresh = RefreshToken.for_user(user)
-            user_data = UserSerializer(user).data
-
-            user_data['wallet_balance'] = str(user_data['wallet_balance'])
 
+            # Build the claims straight from the authenticated user, the wallet balance is a column
+            claims = {
+                'userId': user.id,
+                'userName': user.username,
+                'fullName': f"{user.first_name} {user.last_name}",
+                'email': user.email,
+                'role': user.get_type_display(),
+                'phoneNumber': user.phone_number,
+                'wallet': str(user.wallet_balance if user.type == UserTypes.CUSTOMER else 0),
+            }
             # Add custom data to the token payload
-            refresh['userId'] = user_data['id']
-            refresh['userName'] = user_data['username']
-            refresh['fullName'] = f"{user_data['first_name']} {user_data['last_name']}"
-            refresh['email'] = user_data['email']
-            refresh['role'] = user_data['service_type']
-            refresh['phoneNumber'] = user_data['phone_number']
-            refresh['wallet'] = user_data['wallet_balance']
-
-            return Response({
-                'userId': user_data['id'],
-                'userName': user_data['username'],
-                'fullName': f"{user_data['first_name']} {user_data['last_name']}",
-                'email': user_data['email'],
-                'role': user_data['service_type'],
-                'phoneNumber': user_data['phone_number'],
-                'token': str(refresh.access_token),
-                'wallet': user_data['wallet_balance']
-            }, status=status.HTTP_200_OK)
+            for claim, value in claims.items():
+                refresh[claim] = value
+
+            # Lets ClaimsJWTAuthentication authorize requests without loading the user
+            refresh['type'] = user.type
+
+            return Response({**claims, 'token': str(refresh.access_token)}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -115,7 +139,8 @@ class ChangePasswordView(APIView):
     def put(self, request, *args, **kwargs):
         serializer = ChangePasswordSerializer(data=request.data)
         if serializer.is_valid():
-            user = request.user
+            # request.user may be built from the token claims, change the password on the stored user
+            user = User.objects.get(pk=request.user.pk)
             data = serializer.validated_data
             old_password = data.get('old_password')
             new_password = data.get('new_password')
@@ -124,7 +149,7 @@ class ChangePasswordView(APIView):
                 return Response({'error': 'Wrong old password.'}, status=status.HTTP_400_BAD_REQUEST)
 
             user.set_password(new_password)
-            user.save()
+            user.save(update_fields=['password'])
 
             return Response({'success': 'Password updated successfully.'}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -147,6 +172,8 @@ class AddressEdit(generics.RetrieveUpdateAPIView):
 class PaymentListCreateAPIView(generics.ListCreateAPIView):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         user = self.request.user